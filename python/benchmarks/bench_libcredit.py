@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+# libcredit - module for converting RDF metadata to human-readable strings
+#
+# Copyright 2013 Commons Machinery http://commonsmachinery.se/
+#
+# Distributed under an GPLv2 license, please see LICENSE in the top dir.
+
+"""
+Benchmark libcredit on the shared testcases and on generated scale
+cases: a work with thousands of sources, a deep source chain, many
+creators in an rdf:Seq, and a large graph of unrelated subjects.
+
+Each case is run through the stages of rendering a credit: parsing
+RDF/XML, extracting the credit from the graph, formatting it as text
+and as HTML, and formatting it as text, HTML and token events at once.
+License label lookups are measured separately.  For every stage the
+time per run, the throughput and the peak memory allocated by one run
+(on Pythons with tracemalloc) are reported.
+
+Usage: python benchmarks/bench_libcredit.py [--json results.json]
+                                            [--compare baseline.json]
+"""
+
+import argparse
+import gc
+import glob
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+LIBCREDIT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TESTCASES_DIR = os.path.join(os.path.dirname(LIBCREDIT_DIR), 'testcases')
+sys.path.insert(0, LIBCREDIT_DIR)
+
+import rdflib
+import libcredit
+from libcredit import DC, CC
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+timer = getattr(time, 'perf_counter', time.time)
+
+RDF = rdflib.RDF
+RDF_NS = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
+
+# How deep the formatting stages follow sources, as the command line does
+SOURCE_DEPTH = 10
+
+LICENSE_URLS = [
+    'http://creativecommons.org/licenses/by-sa/3.0/',
+    'https://creativecommons.org/licenses/by-nc-nd/4.0/deed.sv',
+    'http://creativecommons.org/licenses/by/2.5/se/',
+    'http://creativecommons.org/publicdomain/zero/1.0/',
+    'http://creativecommons.org/publicdomain/mark/1.0/',
+    'http://artlibre.org/licence/lal/licence-art-libre-12',
+    'http://www.gnu.org/licenses/gpl.html',
+]
+
+
+class Case(object):
+    """
+    A document to benchmark: its RDF/XML, the graph parsed from it and
+    the subject to credit.
+    """
+    def __init__(self, name, graph, subject):
+        self.name = name
+        self.graph = graph
+        self.subject = subject
+        rdf = graph.serialize(format='xml')
+        if isinstance(rdf, bytes):
+            rdf = rdf.decode('utf-8')
+        self.rdf = rdf
+
+
+def load_testcases():
+    cases = []
+    for path in sorted(glob.glob(os.path.join(TESTCASES_DIR, '*.ttl'))):
+        g = rdflib.Graph()
+        g.parse(path, format='n3')
+
+        # The work is the source of the document itself, i.e. the
+        # object of a dc:source that is not a source of anything else
+        objects = set(g.objects(None, DC['source']))
+        subjects = [o for s, o in g.subject_objects(DC['source']) if s not in objects]
+        if subjects:
+            name = os.path.splitext(os.path.basename(path))[0]
+            cases.append(Case(name, g, subjects[0]))
+    return cases
+
+
+def add_work(g, uri, n):
+    g.add((uri, DC['title'], rdflib.Literal('work %d' % n)))
+    g.add((uri, CC['attributionName'], rdflib.Literal('author %d' % n)))
+    g.add((uri, CC['attributionURL'], rdflib.URIRef('http://author/%d/' % n)))
+    g.add((uri, libcredit.XHV['license'],
+           rdflib.URIRef(LICENSE_URLS[n % len(LICENSE_URLS)])))
+
+
+def many_sources(count):
+    g = rdflib.Graph()
+    work = rdflib.URIRef('http://work/')
+    add_work(g, work, 0)
+    for i in range(count):
+        source = rdflib.URIRef('http://source/%d/' % i)
+        add_work(g, source, i)
+        g.add((work, DC['source'], source))
+    return Case('many-sources-%d' % count, g, work)
+
+
+def deep_chain(length):
+    g = rdflib.Graph()
+    works = [rdflib.URIRef('http://work/%d/' % i) for i in range(length)]
+    for i, work in enumerate(works):
+        add_work(g, work, i)
+    for work, source in zip(works, works[1:]):
+        g.add((work, DC['source'], source))
+    return Case('deep-chain-%d' % length, g, works[0])
+
+
+def many_creators(count):
+    g = rdflib.Graph()
+    work = rdflib.URIRef('http://work/')
+    g.add((work, DC['title'], rdflib.Literal('work')))
+    seq = rdflib.BNode()
+    g.add((work, DC['creator'], seq))
+    g.add((seq, RDF.type, RDF.Seq))
+    for i in range(count):
+        g.add((seq, rdflib.URIRef('%s_%d' % (RDF_NS, i + 1)), rdflib.Literal('creator %d' % i)))
+    return Case('seq-creators-%d' % count, g, work)
+
+
+def large_graph(count):
+    g = rdflib.Graph()
+    work = rdflib.URIRef('http://work/')
+    add_work(g, work, 0)
+    g.add((work, DC['source'], rdflib.URIRef('http://unrelated/0/')))
+    for i in range(count):
+        add_work(g, rdflib.URIRef('http://unrelated/%d/' % i), i)
+    return Case('large-graph-%d' % count, g, work)
+
+
+def generated_cases(scale):
+    """
+    Generate the scale cases one at a time, so that only one of the
+    large graphs is kept in memory.
+    """
+    def n(count):
+        return max(1, int(count * scale))
+    yield many_sources(n(2000))
+    yield deep_chain(n(500))
+    yield many_creators(n(1000))
+    yield large_graph(n(20000))
+
+
+def stages(case):
+    """
+    Return (name, function) for each stage of rendering case.  Each
+    stage starts from the result of the previous one, so that it is
+    measured on its own.
+    """
+    credit = libcredit.Credit(case.graph, case.subject)
+
+    def parse():
+        libcredit.Credit.parse(case.rdf)
+
+    def extract():
+        libcredit.Credit(case.graph, case.subject)
+
+    def format_text():
+        formatter = libcredit.TextCreditFormatter()
+        credit.format(formatter, SOURCE_DEPTH, None)
+        return len(formatter.get_text())
+
+    def format_html():
+        formatter = libcredit.HTMLCreditFormatter()
+        credit.format(formatter, SOURCE_DEPTH, None)
+        return len(formatter.get_text())
+
+    def format_all():
+        formatters = [libcredit.TextCreditFormatter(), libcredit.HTMLCreditFormatter(),
+                      libcredit.TokenCreditFormatter()]
+        credit.format(libcredit.MultiCreditFormatter(formatters), SOURCE_DEPTH, None)
+
+    return [('parse', parse), ('extract', extract),
+            ('format_text', format_text), ('format_html', format_html),
+            ('format_all', format_all)]
+
+
+def license_label_stage():
+    urls = LICENSE_URLS * 100
+
+    def get_license_labels():
+        for url in urls:
+            libcredit.get_license_label(url)
+
+    return len(urls), get_license_labels
+
+
+def measure(func, min_time, min_runs):
+    """
+    Run func until it has run at least min_runs times and for at least
+    min_time seconds.  Return the run times and the peak memory
+    allocated by one more run, or None without tracemalloc.
+    """
+    func()
+    times = []
+    total = 0.0
+
+    # Like timeit, keep the garbage collector from running in between
+    gc.collect()
+    gc.disable()
+    try:
+        while len(times) < min_runs or total < min_time:
+            start = timer()
+            func()
+            elapsed = timer() - start
+            times.append(elapsed)
+            total += elapsed
+    finally:
+        gc.enable()
+
+    peak = None
+    if tracemalloc:
+        gc.collect()
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return times, peak
+
+
+def git_commit():
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=LIBCREDIT_DIR,
+                                      stderr=subprocess.STDOUT)
+        return out.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def result(case, stage, times, peak, items=1):
+    times = sorted(times)
+    median = times[len(times) // 2]
+    return {
+        'case': case,
+        'stage': stage,
+        'runs': len(times),
+        'median_s': median,
+        'min_s': times[0],
+        'items_per_s': items / median if median else None,
+        'peak_bytes': peak,
+    }
+
+
+def print_result(r, baseline=None):
+    line = '%-28s %-12s %10.3f ms %12.1f/s %10s' % (
+        r['case'], r['stage'], r['median_s'] * 1000, r['items_per_s'] or 0,
+        '%d kB' % (r['peak_bytes'] // 1024) if r['peak_bytes'] is not None else '-')
+    if baseline:
+        base = baseline.get((r['case'], r['stage']))
+        if base:
+            line += '  %+6.1f%%' % ((r['median_s'] / base['median_s'] - 1) * 100)
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark libcredit.')
+    parser.add_argument('--json', metavar='PATH',
+                        help='save the results as JSON to PATH')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='show the change in time against results saved with --json')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='scale the size of the generated cases (default: 1.0)')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimum seconds to run each stage (default: 0.2)')
+    parser.add_argument('--min-runs', type=int, default=5,
+                        help='minimum number of runs of each stage (default: 5)')
+    parser.add_argument('--skip-testcases', action='store_true',
+                        help='only run the generated cases')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = dict(((r['case'], r['stage']), r) for r in json.load(f)['results'])
+
+    cases = [] if args.skip_testcases else load_testcases()
+    cases = itertools.chain(cases, generated_cases(args.scale))
+
+    results = []
+    print('%-28s %-12s %13s %14s %10s' % ('case', 'stage', 'median', 'throughput', 'peak mem'))
+    for case in cases:
+        for stage, func in stages(case):
+            times, peak = measure(func, args.min_time, args.min_runs)
+            r = result(case.name, stage, times, peak)
+            results.append(r)
+            print_result(r, baseline)
+
+    count, func = license_label_stage()
+    times, peak = measure(func, args.min_time, args.min_runs)
+    r = result('license-urls-%d' % count, 'label', times, peak, count)
+    results.append(r)
+    print_result(r, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'commit': git_commit(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'rdflib': rdflib.__version__,
+                'scale': args.scale,
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# libcredit - module for converting RDF metadata to human-readable strings
+#
+# Copyright 2013 Commons Machinery http://commonsmachinery.se/
+#
+# Distributed under an GPLv2 license, please see LICENSE in the top dir.
+
+"""
+Measure how long it takes to import libcredit, and to import it and
+look up a license label, in fresh interpreters.
+
+On Python 3.7 and later the time is taken from -X importtime, which
+only counts the imports themselves.  Older Pythons report the wall
+clock time of the whole statement instead.
+
+To compare against another version, check it out somewhere else and
+pass its python directory as the baseline, e.g.:
+
+    git worktree add /tmp/libcredit-base <commit>
+    python benchmarks/import_time.py --baseline /tmp/libcredit-base/python
+
+Usage: python benchmarks/import_time.py [-n RUNS] [--baseline DIR]
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+LIBCREDIT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATEMENTS = [
+    ('import libcredit', 'import libcredit'),
+    ('get_license_label', 'import libcredit; '
+     'libcredit.get_license_label("http://creativecommons.org/licenses/by-sa/4.0/")'),
+]
+
+# Modules that should only be loaded on first use
+LAZY_MODULES = ['rdflib', 'xml.dom.minidom', 'gettext']
+
+_IMPORTTIME_RE = re.compile(r'^import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)$')
+
+def has_importtime():
+    return sys.version_info >= (3, 7)
+
+def run(statement, libcredit_dir=LIBCREDIT_DIR):
+    """
+    Run statement in a new interpreter, importing libcredit from
+    libcredit_dir.  Return the time in microseconds and the names of
+    the lazily loaded modules that it imported.
+    """
+    check = '; import sys; sys.stderr.write("loaded: %%s\\n" %% " ".join(m for m in %r if m in sys.modules))' % (LAZY_MODULES, )
+    env = dict(os.environ, PYTHONPATH=libcredit_dir)
+    # Let the first run write the bytecode, so that later runs don't
+    # spend their time compiling libcredit
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+
+    if has_importtime():
+        cmd = [sys.executable, '-X', 'importtime', '-c', statement + check]
+    else:
+        timer = 'import time; _t = time.time(); %s; sys.stderr.write("wall: %%d\\n" %% ((time.time() - _t) * 1e6))'
+        cmd = [sys.executable, '-c', 'import sys; ' + timer % statement + check]
+
+    proc = subprocess.Popen(cmd, env=env, stderr=subprocess.PIPE, cwd=libcredit_dir)
+    _, err = proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError(err.decode('utf-8', 'replace'))
+
+    total = 0
+    loaded = []
+    counting = False
+    for line in err.decode('utf-8').splitlines():
+        m = _IMPORTTIME_RE.match(line)
+        if m and not m.group(2):
+            # Count libcredit and the top level imports after it, i.e.
+            # modules that it loads on first use, but not the modules
+            # loaded at interpreter startup.  Nested imports are
+            # included in the cumulative time of their parent.
+            counting = counting or m.group(3) == 'libcredit'
+            if counting:
+                total += int(m.group(1))
+        elif line.startswith('wall: '):
+            total = int(line.split()[1])
+        elif line.startswith('loaded: '):
+            loaded = line.split()[1:]
+    return total, loaded
+
+def measure(statement, runs, libcredit_dir):
+    """
+    Return the sorted times of runs imports from libcredit_dir and the
+    lazily loaded modules of the last one.
+    """
+    # The first run compiles the bytecode, so leave it out
+    run(statement, libcredit_dir)
+    times = []
+    for i in range(runs):
+        t, loaded = run(statement, libcredit_dir)
+        times.append(t)
+    times.sort()
+    return times, loaded
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the import time of libcredit.')
+    parser.add_argument('-n', '--runs', type=int, default=20,
+                        help='number of interpreters to start per statement (default: 20)')
+    parser.add_argument('--baseline', metavar='DIR',
+                        help='also measure the libcredit.py in DIR, e.g. the python '
+                        'directory of another checkout, and compare against it')
+    args = parser.parse_args()
+
+    trees = [('current', LIBCREDIT_DIR)]
+    if args.baseline:
+        baseline = os.path.abspath(args.baseline)
+        if not os.path.isfile(os.path.join(baseline, 'libcredit.py')):
+            parser.error('no libcredit.py in %s' % baseline)
+        trees.insert(0, ('baseline', baseline))
+
+    print('Python %s, %s' % (sys.version.split()[0],
+                             '-X importtime' if has_importtime() else 'wall clock'))
+    for name, statement in STATEMENTS:
+        medians = []
+        for tree, libcredit_dir in trees:
+            times, loaded = measure(statement, args.runs, libcredit_dir)
+            medians.append(times[len(times) // 2])
+            label = name if len(trees) == 1 else '%s (%s)' % (name, tree)
+            print('%-31s median %8.1f ms  min %8.1f ms  loaded: %s' % (
+                label, medians[-1] / 1000.0, times[0] / 1000.0,
+                ', '.join(loaded) or '-'))
+        if len(medians) == 2 and medians[0]:
+            print('%-31s %.2fx the median of the baseline' % ('', float(medians[1]) / medians[0]))
+
+if __name__ == '__main__':
+    main()
@@ -8,18 +8,14 @@
 #
 # Distributed under an GPLv2 license, please see LICENSE in the top dir.
 
+import importlib
+import io
+import os
 import sys
 import re
-import gettext
-import rdflib
-from rdflib.namespace import RDF
-from xml.dom import minidom
-
-# py3k compatibility
-try:
-    import urlparse
-except ImportError:
-    import urllib.parse as urlparse
+import time
+import weakref
+from collections import OrderedDict
 
 # We need to make sure that various strings from various places indeed
 # are in unicode in both Python 2 and 3.  Everything is cast, even the
@@ -40,17 +36,104 @@ except NameError:
         return str(s)
 
 
-def get_i18n(languages = None):
-    if languages is None:
-        i18n = gettext.translation('libcredit', sys.prefix + '/share/locale', fallback = True)
-    else:
-        i18n = gettext.translation('libcredit', sys.prefix + '/share/locale', languages = languages)
+class _LazyModule(object):
+    """
+    Stands in for a module that is only imported when one of its
+    attributes is first used, to keep importing libcredit cheap.
+    """
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._name)
+        # Later lookups find the attributes without calling __getattr__
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+rdflib = _LazyModule('rdflib')
+minidom = _LazyModule('xml.dom.minidom')
+gettext = _LazyModule('gettext')
+hashlib = _LazyModule('hashlib')
+json = _LazyModule('json')
+threading = _LazyModule('threading')
+ElementTree = _LazyModule('xml.etree.ElementTree')
+multiprocessing = _LazyModule('multiprocessing')
+tarfile = _LazyModule('tarfile')
+argparse = _LazyModule('argparse')
+
+# py3k compatibility
+if sys.version_info[0] >= 3:
+    urlparse = _LazyModule('urllib.parse')
+else:
+    urlparse = _LazyModule('urlparse')
+
 
-    i18n.set_output_charset('utf-8')
-    return i18n
+class TranslationRegistry(object):
+    """
+    Loads the libcredit translation for each language, or list of
+    languages in order of preference, only once and keeps it, so that
+    switching languages between credits costs a dict lookup.
 
-# Set up a default translation based on the system locale
-_i18n = get_i18n()
+    Keyword arguments:
+    localedir -- directory with the compiled catalogs, as
+                 localedir/<language>/LC_MESSAGES/libcredit.mo.
+                 Defaults to sys.prefix + '/share/locale'.
+    """
+    def __init__(self, localedir=None):
+        self.localedir = localedir or sys.prefix + '/share/locale'
+        self._translations = {}
+
+    def get(self, languages=None):
+        """
+        Return the translation for languages, which is a language code,
+        a list of codes in order of preference, or None for the
+        language of the system locale.  Raises IOError if there is no
+        catalog for any of the given languages.
+        """
+        if languages is None:
+            key = None
+        elif isinstance(languages, basestring):
+            key = (languages, )
+        else:
+            key = tuple(languages)
+
+        i18n = self._translations.get(key)
+        if i18n is None:
+            if key is None:
+                i18n = gettext.translation('libcredit', self.localedir, fallback = True)
+            else:
+                i18n = gettext.translation('libcredit', self.localedir, languages = list(key))
+
+            # Only Python 2 gettext returns encoded strings
+            if sys.version_info[0] < 3:
+                i18n.set_output_charset('utf-8')
+            self._translations[key] = i18n
+        return i18n
+
+    def preload(self, languages):
+        """
+        Load the translations of a list of language codes up front,
+        e.g. when a worker process starts.
+        """
+        for language in languages:
+            self.get(language)
+
+    def clear(self):
+        self._translations.clear()
+
+# Translations used by get_i18n() and Credit.format()
+translation_registry = TranslationRegistry()
+
+def get_i18n(languages = None):
+    """
+    Return the translation for a list of languages, or for the system
+    locale if languages is None.  Each translation is only loaded once,
+    see TranslationRegistry.
+    """
+    return translation_registry.get(languages)
+
+# Default for i18n arguments, meaning the language of the system locale
+_DEFAULT_I18N = object()
 
 
 _cc_license_url_re = re.compile("^https?://creativecommons.org/licenses/([-a-z]+)/([0-9.]+)/(?:([a-z]+)/)?(?:deed\..*)?$")
@@ -59,6 +142,193 @@ _cc_public_domain_url_re = re.compile("^https?://creativecommons.org/publicdomai
 
 _free_art_license_url_re = re.compile("^https?://artlibre.org/licence/lal(?:/([-a-z0-9]+))?$")
 
+class _LRUCache(object):
+    """
+    A mapping that keeps at most maxsize entries, dropping the least
+    recently used entry when it is full.  Counts hits, misses and
+    evictions.
+
+    If maxbytes is given, entries are also dropped while the sum of
+    sizeof(value) over all entries is larger than that.  If ttl is
+    given, entries expire that many seconds after they were stored.
+    """
+    def __init__(self, maxsize, maxbytes=None, ttl=None, sizeof=len):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, size, expires = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= time.time():
+                self.size -= size
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data[key] = (value, size, expires)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        expires = time.time() + self.ttl if self.ttl is not None else None
+
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._data[key] = (value, size, expires)
+            self.size += size
+            while (len(self._data) > self.maxsize or
+                   (self.maxbytes is not None and self.size > self.maxbytes)):
+                self.size -= self._data.popitem(last=False)[1][1]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+def _get_cc_license_label(groups):
+    return 'CC %s %s %s' % (groups[0].upper(), groups[1], "(%s)" % groups[2].upper() if groups[2] else "Unported")
+
+def _get_cc_public_domain_label(groups):
+    if groups[0] == 'zero':
+        return 'CC0 ' + groups[1]
+    elif groups[0] == 'mark':
+        return 'public domain'
+
+def _get_free_art_license_label(groups):
+    return 'Free Art License %s' % ('1.2' if groups[0] == 'licence-art-libre-12' else '1.3')
+
+# Built-in license URL patterns, by host name
+_builtin_license_labels = {
+    'creativecommons.org': [
+        (_cc_license_url_re, _get_cc_license_label),
+        (_cc_public_domain_url_re, _get_cc_public_domain_label),
+    ],
+    'artlibre.org': [
+        (_free_art_license_url_re, _get_free_art_license_label),
+    ],
+}
+
+_license_url_suffix_re = re.compile(r'(?:\.[a-z]{2}(?:[-_][a-zA-Z]{2})?)?\.(?:html?|txt|php)$')
+
+def _normalize_license_url(url):
+    """
+    Return url without http/https, "www.", a trailing slash or a
+    document suffix such as ".html" or ".en.html".
+    """
+    url = ensure_unicode(url).split('://', 1)[-1]
+    if url.startswith('www.'):
+        url = url[4:]
+    url = _license_url_suffix_re.sub('', url.rstrip('/'))
+    return url.rstrip('/')
+
+
+class LicenseLabelResolver(object):
+    """
+    Resolves license URLs to human-readable short names.  The result
+    for each URL is kept in a bounded cache, so the URL patterns only
+    have to be matched the first time a URL is seen.
+
+    Keyword arguments:
+    cache_size -- maximum number of URLs to keep in the cache
+    """
+    def __init__(self, cache_size=1024):
+        self._cache = _LRUCache(cache_size)
+        self._families = {}
+
+    @property
+    def hits(self):
+        "Number of lookups answered from the cache."
+        return self._cache.hits
+
+    @property
+    def misses(self):
+        "Number of lookups that had to resolve the URL."
+        return self._cache.misses
+
+    def register(self, url, label):
+        """
+        Register a license or a family of licenses.  The license URL
+        and any URL below it get the label.  The scheme, a leading
+        "www.", a trailing slash and suffixes like ".html" are ignored
+        when matching.
+
+        Parameters:
+        url -- license URL or common prefix of a family of licenses,
+               e.g. "http://www.gnu.org/licenses/gpl-3.0"
+        label -- short name, or a function that takes the license URL
+                 and returns the short name
+        """
+        self._families[_normalize_license_url(url)] = label
+        self._cache.clear()
+
+    def get_label(self, url):
+        """
+        Return a human-readable short name for a license.
+        If the URL is unknown, it is returned as-is.
+
+        Parameters:
+        url -- the license URL
+        """
+        label = self._cache.get(url)
+        if label is None:
+            label = self._resolve(url)
+            self._cache.put(url, label)
+        return label
+
+    def _resolve(self, url):
+        if self._families:
+            # Look up the URL and each of its parents in the table
+            key = _normalize_license_url(url)
+            while key:
+                label = self._families.get(key)
+                if label is not None:
+                    return label(url) if callable(label) else label
+                key = key.rpartition('/')[0]
+
+        for regex, get_label in _builtin_license_labels.get(_get_host(url), ()):
+            m = regex.match(url)
+            if m:
+                label = get_label(m.groups())
+                if label:
+                    return label
+
+        return url
+
+
+def _get_host(url):
+    """
+    Return the host part of url, or an empty string if it can't be
+    parsed, e.g. because of an unclosed IPv6 address.
+    """
+    try:
+        return urlparse.urlparse(url)[1]
+    except ValueError:
+        return ''
+
+
+# Resolver used by get_license_label() and Credit
+license_label_resolver = LicenseLabelResolver()
+
 def get_license_label(url):
     """
     Return a human-readable short name for a license.
@@ -67,26 +337,7 @@ def get_license_label(url):
     Parameters:
     url -- the license URL
     """
-
-    m = _cc_license_url_re.match(url)
-    if m:
-        g = m.groups()
-        return 'CC %s %s %s' % (g[0].upper(), g[1], "(%s)" % g[2].upper() if g[2] else "Unported")
-
-    m = _cc_public_domain_url_re.match(url)
-    if m:
-        g = m.groups()
-        if g[0] == 'zero':
-            return 'CC0 ' + g[1]
-        elif g[0] == 'mark':
-            return 'public domain'
-
-    m = _free_art_license_url_re.match(url)
-    if m:
-        g = m.groups()
-        return 'Free Art License %s' % ('1.2' if g[0] == 'licence-art-libre-12' else '1.3')
-
-    return url;
+    return license_label_resolver.get_label(url)
 
 
 # credit markup templates for metadata of various completeness
@@ -104,12 +355,178 @@ CREDIT_MARKUP = {
 
 ITEM_RE = re.compile('(<[a-z]+>)')
 
+_TEMPLATE_ITEMS = {
+    u'<title>': 'title',
+    u'<attrib>': 'attrib',
+    u'<license>': 'license',
+}
+
+# Compiled templates and source labels for each translation object,
+# see _get_templates()
+_translated_templates = weakref.WeakKeyDictionary()
+_untranslated_templates = {}
 
-DC = rdflib.Namespace('http://purl.org/dc/elements/1.1/')
-DCTERMS = rdflib.Namespace('http://purl.org/dc/terms/')
-CC = rdflib.Namespace('http://creativecommons.org/ns#')
-XHV = rdflib.Namespace('http://www.w3.org/1999/xhtml/vocab#')
-OG = rdflib.Namespace('http://ogp.me/ns#')
+def _get_templates(i18n):
+    """
+    Return the dict of compiled credit templates and source labels for
+    a translation, which is filled in by Credit.format() as they are
+    needed.
+    """
+    if not i18n:
+        return _untranslated_templates
+    try:
+        return _translated_templates[i18n]
+    except KeyError:
+        templates = _translated_templates[i18n] = {}
+        return templates
+    except TypeError:
+        # can't be weakly referenced, so don't cache anything
+        return {}
+
+def _compile_template(key, i18n):
+    """
+    Translate the credit markup for key and split it into a list of
+    (item, text) pairs, where item is "title", "attrib", "license" or
+    None for plain text.
+    """
+    markup = CREDIT_MARKUP[key]
+    if not markup:
+        return []
+
+    if i18n:
+        markup = ensure_unicode(getattr(i18n, 'ugettext', i18n.gettext)(markup))
+
+    template = []
+    for item in ITEM_RE.split(markup):
+        if item in _TEMPLATE_ITEMS:
+            template.append((_TEMPLATE_ITEMS[item], None))
+        elif item:
+            template.append((None, item))
+    return template
+
+def _get_source_label(count, i18n):
+    if i18n:
+        ngettext = getattr(i18n, 'ungettext', i18n.ngettext)
+        return ensure_unicode(ngettext('Source:', 'Sources:', count))
+    else:
+        return u'Sources:' if count > 1 else u'Source:'
+
+
+class _Namespace(type(u'')):
+    """
+    A namespace URI that gives the URIRef of a term in it with
+    ns['term'], but doesn't need rdflib until a term is looked up.
+    """
+    def __getitem__(self, name):
+        return rdflib.URIRef(self + name)
+
+_DC = _Namespace(u'http://purl.org/dc/elements/1.1/')
+_DCTERMS = _Namespace(u'http://purl.org/dc/terms/')
+_CC = _Namespace(u'http://creativecommons.org/ns#')
+_XHV = _Namespace(u'http://www.w3.org/1999/xhtml/vocab#')
+_OG = _Namespace(u'http://ogp.me/ns#')
+
+# For formatters, which may format credits without any graph
+_DC_SOURCE_URI = _DC + u'source'
+
+# The public namespaces DC, DCTERMS, CC, XHV, OG and RDF are the
+# rdflib.Namespace objects, created on first access on Python 3.7 and
+# later, where a module can have __getattr__
+_PUBLIC_NAMESPACES = {
+    'DC': _DC,
+    'DCTERMS': _DCTERMS,
+    'CC': _CC,
+    'XHV': _XHV,
+    'OG': _OG,
+}
+
+def _get_public_namespace(name):
+    if name == 'RDF':
+        _load_terms()
+        return RDF
+    namespace = rdflib.Namespace(_PUBLIC_NAMESPACES[name])
+    globals()[name] = namespace
+    return namespace
+
+def __getattr__(name):
+    if name == 'RDF' or name in _PUBLIC_NAMESPACES:
+        return _get_public_namespace(name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+def __dir__():
+    return sorted(set(globals()) | set(_PUBLIC_NAMESPACES) | set(['RDF']))
+
+# Base URI of documents in other syntaxes than RDF/XML parsed by
+# Credit.parse(), where <> is the document itself
+DOCUMENT_URI = u'http://libcredit.invalid/'
+
+# Terms read by Credit, set up by _load_terms() when the first graph
+# is read.  The property lists are in order of preference.
+_DC_TITLE = _DC_CREATOR = _DC_RIGHTS = _DC_SOURCE = None
+_OG_URL = _CC_ATTRIBUTION_NAME = _CC_ATTRIBUTION_URL = _XHV_LICENSE = None
+_TITLE_PROPERTIES = None
+_CREATOR_PROPERTIES = None
+_LICENSE_PROPERTIES = None
+_SOURCE_PROPERTIES = None
+_TWITTER_CREATOR = None
+_FLICKR_BY = None
+_CREDIT_PROPERTIES = None
+
+# One shared string per property, so that the tokens of many credits
+# don't each carry their own copy of the same property URI
+_PROPERTY_STRINGS = {}
+
+
+def _load_terms():
+    """
+    Import rdflib and set up the RDF terms that Credit uses, including
+    the module constant RDF.
+    """
+    global RDF, _DC_TITLE, _DC_CREATOR, _DC_RIGHTS, _DC_SOURCE
+    global _OG_URL, _CC_ATTRIBUTION_NAME, _CC_ATTRIBUTION_URL, _XHV_LICENSE
+    global _TITLE_PROPERTIES, _CREATOR_PROPERTIES, _LICENSE_PROPERTIES
+    global _SOURCE_PROPERTIES, _TWITTER_CREATOR, _FLICKR_BY, _CREDIT_PROPERTIES
+
+    if _CREDIT_PROPERTIES is not None:
+        return
+
+    from rdflib.namespace import RDF
+
+    _DC_TITLE = _DC['title']
+    _DC_CREATOR = _DC['creator']
+    _DC_RIGHTS = _DC['rights']
+    _DC_SOURCE = _DC['source']
+    _OG_URL = _OG['url']
+    _CC_ATTRIBUTION_NAME = _CC['attributionName']
+    _CC_ATTRIBUTION_URL = _CC['attributionURL']
+    _XHV_LICENSE = _XHV['license']
+
+    _TITLE_PROPERTIES = [_DC_TITLE, _DCTERMS['title'], _OG['title']]
+    _CREATOR_PROPERTIES = [_DC_CREATOR, _DCTERMS['creator']]
+    _LICENSE_PROPERTIES = [_XHV_LICENSE, _CC['license'], _DCTERMS['license']]
+    _SOURCE_PROPERTIES = [_DC_SOURCE, _DCTERMS['source']]
+    _TWITTER_CREATOR = rdflib.URIRef('twitter:creator')
+    _FLICKR_BY = rdflib.URIRef('flickr_photos:by')
+
+    properties = frozenset(
+        _TITLE_PROPERTIES + _CREATOR_PROPERTIES + _LICENSE_PROPERTIES + _SOURCE_PROPERTIES +
+        [_OG_URL, _CC_ATTRIBUTION_NAME, _CC_ATTRIBUTION_URL, _DC_RIGHTS,
+         _TWITTER_CREATOR, _FLICKR_BY])
+    for p in properties:
+        _PROPERTY_STRINGS.setdefault(ensure_unicode(p), ensure_unicode(p))
+    _CREDIT_PROPERTIES = properties
+
+
+def _intern_property(p):
+    if not p:
+        return None
+    p = ensure_unicode(p)
+    return _PROPERTY_STRINGS.get(p, p)
+
+if sys.version_info < (3, 7):
+    for _name in ['RDF'] + list(_PUBLIC_NAMESPACES):
+        _get_public_namespace(_name)
+    del _name
 
 
 def a2uri(obj):
@@ -142,12 +559,384 @@ class CreditToken(object):
     """
     An object for storing title, attribution or license text and semantics.
     """
+    __slots__ = ('text', 'url', 'text_property', 'url_property', '__weakref__')
+
     def __init__(self, text=None, url=None, text_property=None, url_property=None):
         self.text = text
         self.url = url
         self.text_property = text_property
         self.url_property = url_property
 
+    def __getstate__(self):
+        return (self.text, self.url, self.text_property, self.url_property)
+
+    def __setstate__(self, state):
+        self.text, self.url, text_property, url_property = state
+        self.text_property = _intern_property(text_property)
+        self.url_property = _intern_property(url_property)
+
+    def _freeze(self):
+        """
+        Return a copy of the token that only holds plain strings.
+        """
+        text = self.text
+        if isinstance(text, (list, tuple)):
+            text = [ensure_unicode(t) for t in text]
+        elif text is not None:
+            text = ensure_unicode(text)
+        return CreditToken(text,
+                           ensure_unicode(self.url) if self.url is not None else None,
+                           self.text_property, self.url_property)
+
+class _CreditGraph(object):
+    """
+    Looks up the properties that Credit reads in an rdflib graph.
+    All credits extracted from a graph at the same time share one
+    instance, and with it the extracted fields of each subject.
+    """
+    def __init__(self, g):
+        _load_terms()
+        self.g = g
+        self.extracted = {}
+        self.indexes = None
+        # Container nodes and their types, and the rdf:first and
+        # rdf:rest of collections, loaded when first needed
+        self.container_types = None
+        self.list_first = None
+        self.list_rest = None
+        # Number of queries made on the rdflib graph, and how many of
+        # them were for finding and reading containers
+        self.queries = 0
+        self.container_queries = 0
+
+    def get_index(self, subject):
+        """
+        Return a dict mapping the properties that Credit reads to the
+        values that subject has for them, collected in a single pass
+        over the triples of subject.
+        """
+        if self.indexes is not None:
+            return self.indexes.get(subject, {})
+
+        index = {}
+        self.queries += 1
+        for p, o in self.g.predicate_objects(subject):
+            if p in _CREDIT_PROPERTIES:
+                if p in index:
+                    index[p].append(o)
+                else:
+                    index[p] = [o]
+        return index
+
+    def index_all(self):
+        """
+        Build the property index of all subjects in the graph, with
+        one pass over the graph per property rather than one per
+        subject.
+
+        Returns the subjects that have any of the properties, in the
+        order they were found.
+        """
+        indexes = {}
+        subjects = []
+        for p in sorted(_CREDIT_PROPERTIES):
+            self.queries += 1
+            for s, o in self.g.subject_objects(p):
+                index = indexes.get(s)
+                if index is None:
+                    index = indexes[s] = {}
+                    subjects.append(s)
+                if p in index:
+                    index[p].append(o)
+                else:
+                    index[p] = [o]
+
+        self.indexes = indexes
+        return subjects
+
+    def is_container(self, value):
+        """
+        Return True if value is an RDF container (rdf:Alt, rdf:Seq or
+        rdf:Bag) or a collection (rdf:List).  Only blank nodes are
+        checked for being collections, since that's what the RDF
+        syntaxes use for them.
+        """
+        if isinstance(value, rdflib.Literal):
+            return False
+        if self.container_types is None:
+            self._load_container_types()
+        if value in self.container_types:
+            return True
+        if isinstance(value, rdflib.BNode):
+            if self.list_first is None:
+                self._load_lists()
+            return value in self.list_first
+        return value == RDF.nil
+
+    def parse_container(self, subject):
+        """
+        Return the members of a container or collection, in order.
+        For an rdf:Alt only the first member is returned.
+        """
+        if self.container_types is None:
+            self._load_container_types()
+
+        container_type = self.container_types.get(subject)
+        if container_type is not None:
+            items = self._get_container_items(subject)
+            result = [ensure_unicode(items[n]) for n in sorted(items)]
+            if container_type == RDF.Alt:
+                return result[0] if result else None
+            return result
+
+        if self.list_first is None:
+            self._load_lists()
+
+        result = []
+        seen = set()
+        node = subject
+        while node in self.list_first and node not in seen:
+            seen.add(node)
+            result.append(ensure_unicode(self.list_first[node]))
+            node = self.list_rest.get(node)
+        return result
+
+    def _load_container_types(self):
+        """
+        Find the container nodes of all types with one query per type,
+        instead of checking the type of every value that is read.
+        """
+        container_types = {}
+        for t in (RDF.Alt, RDF.Seq, RDF.Bag):
+            self.queries += 1
+            self.container_queries += 1
+            for s in self.g.subjects(RDF.type, t):
+                container_types.setdefault(s, t)
+        self.container_types = container_types
+
+    def _load_lists(self):
+        """
+        Collect rdf:first and rdf:rest of all collection nodes, so that
+        collections can be walked without a query per member.
+        """
+        self.queries += 1
+        self.container_queries += 1
+        self.list_first = dict(self.g.subject_objects(RDF.first))
+        if self.list_first:
+            self.queries += 1
+            self.container_queries += 1
+            self.list_rest = dict(self.g.subject_objects(RDF.rest))
+        else:
+            self.list_rest = {}
+
+    def _get_container_items(self, subject):
+        """
+        Return a dict mapping n to the rdf:_n member of a container,
+        collected in a single pass over the triples of the container.
+        """
+        items = {}
+        self.queries += 1
+        self.container_queries += 1
+        for p, o in self.g.predicate_objects(subject):
+            if p.startswith(_RDF_MEMBER):
+                try:
+                    items[int(p[len(_RDF_MEMBER):])] = o
+                except ValueError:
+                    pass
+        return items
+
+    def get_default_subject(self):
+        # by the new convention, work is an object of a dc:source predicate for the about="" node
+        for document in (u'', DOCUMENT_URI):
+            sources = self.get_index(a2uri(document)).get(_DC_SOURCE)
+            if sources:
+                return a2uri(sources[0])
+        raise ValueError('no subject given, and the document has no dc:source '
+                         'to find the work by')
+
+
+_RDF_NS = u'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
+_XML_NS = u'http://www.w3.org/XML/1998/namespace'
+
+# Prefix of the rdf:_1, rdf:_2, ... container membership properties
+_RDF_MEMBER = _RDF_NS + u'_'
+
+_RDF_RDF = u'{%s}RDF' % _RDF_NS
+_RDF_DESCRIPTION = u'{%s}Description' % _RDF_NS
+_RDF_ABOUT = u'{%s}about' % _RDF_NS
+_RDF_NODEID = u'{%s}nodeID' % _RDF_NS
+_RDF_RESOURCE = u'{%s}resource' % _RDF_NS
+_RDF_DATATYPE = u'{%s}datatype' % _RDF_NS
+_RDF_PARSETYPE = u'{%s}parseType' % _RDF_NS
+_RDF_TYPE = u'{%s}type' % _RDF_NS
+_RDF_LI = u'{%s}li' % _RDF_NS
+_XML_LANG = u'{%s}lang' % _XML_NS
+
+class _UnsupportedRDF(Exception):
+    """
+    Raised by _XMLCreditGraph for RDF/XML that it does not handle.
+    """
+    pass
+
+class _XMLCreditGraph(_CreditGraph):
+    """
+    A _CreditGraph read straight from a small RDF/XML document, such
+    as an XMP packet, without building an rdflib graph.  Only the
+    properties that Credit reads, container types, container members
+    and collection nodes are kept.
+
+    The document is read with iterparse and each top-level node is
+    dropped as soon as it has been read.  Raises _UnsupportedRDF for
+    anything but the common subset of RDF/XML, in which case the
+    document should be parsed with rdflib instead.
+    """
+    def __init__(self, rdf):
+        _CreditGraph.__init__(self, None)
+        self.indexes = {}
+        self.container_types = {}
+        self.container_items = {}
+        self.list_first = {}
+        self.list_rest = {}
+        self.bnodes = {}
+
+        if not isinstance(rdf, bytes):
+            rdf = rdf.encode('utf-8')
+
+        # The rdf:RDF element may be wrapped in other elements, e.g. x:xmpmeta
+        depth = 0
+        rdf_depth = None
+        found = False
+        try:
+            for event, elem in ElementTree.iterparse(io.BytesIO(rdf), ('start', 'end')):
+                if event == 'start':
+                    depth += 1
+                    if elem.tag == _RDF_RDF and not found:
+                        rdf_depth = depth
+                        found = True
+                else:
+                    if depth == rdf_depth:
+                        rdf_depth = None
+                    elif rdf_depth is not None and depth == rdf_depth + 1:
+                        self._read_node(elem)
+                        elem.clear()
+                    depth -= 1
+        except ElementTree.ParseError as e:
+            raise _UnsupportedRDF(str(e))
+
+        if not found:
+            raise _UnsupportedRDF('no rdf:RDF element')
+
+    def _get_container_items(self, subject):
+        return self.container_items.get(subject, {})
+
+    def _add(self, subject, predicate, obj):
+        if predicate in _CREDIT_PROPERTIES:
+            index = self.indexes.get(subject)
+            if index is None:
+                index = self.indexes[subject] = {}
+            if predicate in index:
+                index[predicate].append(obj)
+            else:
+                index[predicate] = [obj]
+        elif predicate == RDF.type:
+            if obj in (RDF.Alt, RDF.Seq, RDF.Bag):
+                self.container_types.setdefault(subject, obj)
+        elif predicate == RDF.first:
+            self.list_first[subject] = obj
+        elif predicate == RDF.rest:
+            self.list_rest[subject] = obj
+        elif predicate.startswith(_RDF_MEMBER):
+            try:
+                n = int(predicate[len(_RDF_MEMBER):])
+            except ValueError:
+                return
+            self.container_items.setdefault(subject, {})[n] = obj
+
+    def _get_uri(self, tag):
+        if not tag.startswith(u'{'):
+            raise _UnsupportedRDF('element or attribute without namespace: %s' % tag)
+        return rdflib.URIRef(tag[1:].replace(u'}', u'', 1))
+
+    def _get_bnode(self, node_id):
+        bnode = self.bnodes.get(node_id)
+        if bnode is None:
+            bnode = self.bnodes[node_id] = rdflib.BNode()
+        return bnode
+
+    def _check_attributes(self, elem, allowed):
+        for name in elem.attrib:
+            if name.startswith(u'{%s}' % _XML_NS):
+                if name != _XML_LANG:
+                    raise _UnsupportedRDF('unsupported attribute %s' % name)
+            elif name.startswith(u'{%s}' % _RDF_NS) and name not in allowed:
+                raise _UnsupportedRDF('unsupported attribute %s' % name)
+
+    def _add_property_attributes(self, subject, elem):
+        for name, value in elem.attrib.items():
+            if name == _RDF_TYPE:
+                self._add(subject, RDF.type, rdflib.URIRef(value))
+            elif not name.startswith((u'{%s}' % _RDF_NS, u'{%s}' % _XML_NS)):
+                self._add(subject, self._get_uri(name), rdflib.Literal(value))
+
+    def _read_node(self, elem):
+        """
+        Read a node element and return its subject.
+        """
+        self._check_attributes(elem, (_RDF_ABOUT, _RDF_NODEID, _RDF_TYPE))
+
+        if _RDF_ABOUT in elem.attrib:
+            subject = rdflib.URIRef(elem.attrib[_RDF_ABOUT])
+        elif _RDF_NODEID in elem.attrib:
+            subject = self._get_bnode(elem.attrib[_RDF_NODEID])
+        else:
+            subject = rdflib.BNode()
+
+        if elem.tag != _RDF_DESCRIPTION:
+            self._add(subject, RDF.type, self._get_uri(elem.tag))
+
+        self._add_property_attributes(subject, elem)
+        self._read_properties(subject, elem)
+        return subject
+
+    def _read_properties(self, subject, elem):
+        li = 0
+        for child in elem:
+            if child.tag == _RDF_LI:
+                li += 1
+                predicate = rdflib.URIRef(u'%s_%d' % (_RDF_NS, li))
+            else:
+                predicate = self._get_uri(child.tag)
+            self._read_property(subject, predicate, child)
+
+    def _read_property(self, subject, predicate, elem):
+        self._check_attributes(elem, (_RDF_RESOURCE, _RDF_NODEID, _RDF_DATATYPE, _RDF_PARSETYPE))
+        attrib = elem.attrib
+        parse_type = attrib.get(_RDF_PARSETYPE)
+
+        if parse_type == u'Resource':
+            obj = rdflib.BNode()
+            self._read_properties(obj, elem)
+        elif parse_type is not None:
+            raise _UnsupportedRDF('unsupported parseType %s' % parse_type)
+        elif len(elem):
+            if len(elem) != 1:
+                raise _UnsupportedRDF('property element with several nodes')
+            obj = self._read_node(elem[0])
+        elif _RDF_RESOURCE in attrib:
+            obj = rdflib.URIRef(attrib[_RDF_RESOURCE])
+            self._add_property_attributes(obj, elem)
+        elif _RDF_NODEID in attrib:
+            obj = self._get_bnode(attrib[_RDF_NODEID])
+            self._add_property_attributes(obj, elem)
+        elif [name for name in attrib if name not in (_XML_LANG, _RDF_DATATYPE)]:
+            obj = rdflib.BNode()
+            self._add_property_attributes(obj, elem)
+        else:
+            obj = rdflib.Literal(elem.text or u'')
+
+        self._add(subject, predicate, obj)
+
+
 class Credit(object):
     """
     Class for extracting credit information from RDF metadata
@@ -155,168 +944,405 @@ class Credit(object):
     Keyword arguments:
     rdf -- rdflib graph or a string of RDF/XML to parse.
     subject -- URI for querying work in the graph
+    lazy -- if True, look up the credit fields and the sources only
+            when they are first accessed, e.g. by format()
+    fast -- if True, read a string of RDF/XML directly instead of
+            parsing it into an rdflib graph.  This is much faster for
+            small documents such as XMP packets.  Documents that use
+            less common RDF/XML features are still parsed with rdflib.
+            self.g is None if the fast path was used.
+    cache -- a CreditCache to look up a string of RDF in before
+             parsing it.  A credit from the cache is frozen (see
+             freeze()) and its g is None.  New credits are added to
+             the cache, which extracts all of them even in lazy mode.
+    stats -- a CreditStats to add the time spent parsing and extracting
+             and the number of graph queries and sources to.  In lazy
+             mode only parsing is counted.
     """
-    def __init__(self, rdf, subject=None):
+
+    __slots__ = ('g', 'subject', '_graph', '_title', '_attrib', '_license',
+                 '_sources', '_source_subjects', '_credits', '__weakref__')
+
+    # Number of RDF documents parsed by Credit.parse() so far
+    parse_count = 0
+
+    @classmethod
+    def parse(cls, rdf, format='xml'):
+        """
+        Parse a string of RDF/XML into an rdflib graph, which can
+        then be shared by any number of Credit objects.
+
+        Parameters:
+        rdf -- a string of RDF/XML
+        format -- rdflib parser to use for other RDF syntaxes, e.g. "turtle".
+                  These are parsed with DOCUMENT_URI as the base URI,
+                  since the Turtle parser would otherwise resolve <>
+                  against the current directory.
+        """
+        g = rdflib.Graph()
+        if format == 'xml':
+            g.parse(data=rdf, format=format)
+        else:
+            g.parse(data=rdf, format=format, publicID=DOCUMENT_URI)
+        cls.parse_count += 1
+        return g
+
+    def __init__(self, rdf, subject=None, lazy=False, fast=False, cache=None, stats=None):
+        if stats is not None:
+            start = _timer()
+
+        cache_key = None
+        if cache is not None and isinstance(rdf, (bytes, basestring)):
+            cache_key = cache.get_key(rdf, subject)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                self._set_frozen(cached.subject, cached._title, cached._attrib,
+                                 cached._license, cached._sources)
+                if stats is not None:
+                    stats.cache_hits += 1
+                return
+
         if isinstance(rdf, rdflib.Graph):
-            self.g = rdf
+            self._graph = _CreditGraph(rdf)
+        elif fast:
+            try:
+                self._graph = _XMLCreditGraph(rdf)
+            except _UnsupportedRDF:
+                self._graph = _CreditGraph(Credit.parse(rdf))
         else:
-            self.g = rdflib.Graph()
-            self.g.parse(data=rdf)
+            self._graph = _CreditGraph(Credit.parse(rdf))
+        self.g = self._graph.g
+
+        if stats is not None:
+            parsed = _timer()
+            stats.add_time('parse', parsed - start)
 
         if subject is None:
-            # by the new convention, work is an object of a dc:source predicate for the about="" node
-            subject = a2uri(next(self.g[a2uri(''):DC['source']:]))
+            subject = self._graph.get_default_subject()
         else:
             subject = a2uri(subject)
+
         self.subject = subject
+        self._title = self._attrib = self._license = None
+        self._sources = None
+
+        if lazy:
+            self._credits = {subject: self}
+        else:
+            self._extract()
+            if stats is not None:
+                extracted = _timer()
+                stats.add_time('extract', extracted - parsed)
 
-        self.title = CreditToken()
-        self.attrib = CreditToken()
-        self.license = CreditToken()
+            sources = self._load_sources()
+
+            if stats is not None:
+                stats.add_time('sources', _timer() - extracted)
+                stats.graph_queries += self._graph.queries
+                stats.container_queries += self._graph.container_queries
+                stats.subjects_extracted += len(self._graph.extracted)
+                stats.sources += sources
+
+        if cache_key is not None:
+            cache.put(cache_key, self)
+
+    @classmethod
+    def extract_many(cls, rdf, subjects=None):
+        """
+        Generate credits for many subjects in the same graph.
+
+        The properties of all subjects are collected up front with a
+        single pass over the graph per property, and each subject is
+        only extracted once even if it is a source of several works.
+
+        Keyword arguments:
+        rdf -- rdflib graph or a string of RDF/XML to parse.
+        subjects -- URIs of the works to generate credits for.  If
+                    omitted, credits are generated for all subjects
+                    with any credit information.
+        """
+        if isinstance(rdf, rdflib.Graph):
+            g = rdf
+        else:
+            g = cls.parse(rdf)
+
+        graph = _CreditGraph(g)
+        found = graph.index_all()
+
+        if subjects is None:
+            subjects = found
+        else:
+            subjects = (a2uri(s) for s in subjects)
+
+        for subject in subjects:
+            credit = cls._from_graph(graph, subject)
+            credit._load_sources()
+            yield credit
+
+    @classmethod
+    def _from_graph(cls, graph, subject):
+        """
+        Create a credit for subject in a _CreditGraph without loading
+        its sources.
+        """
+        credit = cls.__new__(cls)
+        credit.g = graph.g
+        credit._graph = graph
+        credit.subject = subject
+        credit._sources = []
+        credit._extract()
+        return credit
+
+    @classmethod
+    def _lazy_source(cls, parent, subject):
+        """
+        Create a lazy credit for a source of parent.  Like in eager
+        mode there is one credit per subject in the source graph of
+        the work, which all its lazy credits find in the same
+        _credits map.
+        """
+        credit = cls.__new__(cls)
+        credit.g = parent.g
+        credit._graph = parent._graph
+        credit.subject = subject
+        credit._title = credit._attrib = credit._license = None
+        credit._sources = None
+        credit._credits = parent._credits
+        credit._credits[subject] = credit
+        return credit
+
+    @property
+    def title(self):
+        if self._title is None:
+            self._extract()
+        return self._title
+
+    @title.setter
+    def title(self, token):
+        # Extract the other fields first, so that they don't overwrite this one
+        if self._title is None:
+            self._extract()
+        self._title = token
+
+    @property
+    def attrib(self):
+        if self._attrib is None:
+            self._extract()
+        return self._attrib
+
+    @attrib.setter
+    def attrib(self, token):
+        if self._attrib is None:
+            self._extract()
+        self._attrib = token
+
+    @property
+    def license(self):
+        if self._license is None:
+            self._extract()
+        return self._license
+
+    @license.setter
+    def license(self, token):
+        if self._license is None:
+            self._extract()
+        self._license = token
+
+    @property
+    def sources(self):
+        """
+        List of Credit objects for the source works.  In lazy mode the
+        sources are only looked up the first time this is accessed.
+
+        Credits for the same subject are shared, so in a graph with
+        cycles a source can lead back to this credit.  Code that walks
+        the sources should keep track of the credits it has visited.
+        """
+        if self._sources is None:
+            if self._title is None:
+                self._extract()
+            credits = self._credits
+            self._sources = [
+                credits.get(s) or Credit._lazy_source(self, s)
+                for s in self._source_subjects]
+        return self._sources
+
+    @sources.setter
+    def sources(self, sources):
+        self._sources = sources
+
+    def _extract(self):
+        # Credits for the same subject share the extracted fields, even
+        # when they are reached through different paths
+        extracted = self._graph.extracted.get(self.subject)
+        if extracted:
+            (self._title, self._attrib, self._license,
+             self._source_subjects) = extracted
+            return
+
+        subject = self.subject
+        index = self._graph.get_index(subject)
+        title = self._title = CreditToken()
+        attrib = self._attrib = CreditToken()
+        license = self._license = CreditToken()
 
         #
         # Title
         #
 
-        self.title.url = get_url(self._get_property_any(subject, OG['url']))
+        title.url = get_url(self._get_property_any(index, _OG_URL))
 
-        if self.title.url is None:
-            self.title.url = get_url(ensure_unicode(subject))
+        if title.url is None:
+            title.url = get_url(ensure_unicode(subject))
 
-        self.title.text = self._get_property_any(subject, [
-            DC['title'],
-            DCTERMS['title'],
-            OG['title'],
-        ])
-        self.title.text_property = (DC['title'] if self.title.text else None)
+        title.text = self._get_property_any(index, _TITLE_PROPERTIES)
+        title.text_property = (_DC_TITLE if title.text else None)
 
-        if not self.title.text:
-            self.title.text = self.title.url
+        if not title.text:
+            title.text = title.url
 
         #
         # Attribution
         #
-        self.attrib.text = self._get_property_any(subject, CC['attributionName'])
-        if self.attrib.text:
-            self.attrib.text_property = CC['attributionName']
-        self.attrib.url = get_url(self._get_property_any(subject, CC['attributionURL']))
-        if self.attrib.url:
-            self.attrib.url_property = CC['attributionURL']
-
-        if not self.attrib.text:
-            creators = self._get_property_all(subject, [
-                DC['creator'],
-                DCTERMS['creator'],
-            ])
+        attrib.text = self._get_property_any(index, _CC_ATTRIBUTION_NAME)
+        if attrib.text:
+            attrib.text_property = _CC_ATTRIBUTION_NAME
+        attrib.url = get_url(self._get_property_any(index, _CC_ATTRIBUTION_URL))
+        if attrib.url:
+            attrib.url_property = _CC_ATTRIBUTION_URL
+
+        if not attrib.text:
+            creators = self._get_property_all(index, _CREATOR_PROPERTIES)
 
             if len(creators) == 1:
-                self.attrib.text = creators[0]
+                attrib.text = creators[0]
             else:
                 # save the full list of creators for credit formatter
-                self.attrib.text = creators
+                attrib.text = creators
 
         # fallback to twitter:creator is dc*:creator fails
-        if not self.attrib.text:
-            self.attrib.text = self._get_property_any(subject, ['twitter:creator'])
+        if not attrib.text:
+            attrib.text = self._get_property_any(index, _TWITTER_CREATOR)
 
         # flickr_photos:by seems to be used by flickr for the same purpose
         # that we use cc:attributionURL for, should that go to attributionURL instead?
-        if urlparse.urlparse(str(subject))[1] == "www.flickr.com":
-            try:
-                flickr_by = next(self.g[subject:a2uri(u'flickr_photos:by')])
-            except StopIteration:
-                flickr_by = None
+        if _get_host(str(subject)) == "www.flickr.com":
+            flickr_by = index.get(_FLICKR_BY, [None])[0]
 
             # could we just use /people/XXX/ as the last resort?
             # flickr_by = urlparse.urlparse(str(flickr_by))[2].split('/')[-2]
 
-            if not self.attrib.text and flickr_by:
-                self.attrib.text = ensure_unicode(flickr_by)
+            if not attrib.text and flickr_by:
+                attrib.text = ensure_unicode(flickr_by)
 
         #  make things a little simpler by putting dc:creator into the semantics
-        if not self.attrib.text_property:
-            self.attrib.text_property = (DC['creator'] if self.attrib.text else None)
+        if not attrib.text_property:
+            attrib.text_property = (_DC_CREATOR if attrib.text else None)
 
-        if self.attrib.text and self.attrib.url is None:
-            self.attrib.url = get_url(self.attrib.text)
+        if attrib.text and attrib.url is None:
+            attrib.url = get_url(attrib.text)
 
-        if not self.attrib.text:
-            self.attrib.text = self.attrib.url
+        if not attrib.text:
+            attrib.text = attrib.url
 
         #
         # License
         #
 
-        self.license.url = get_url(self._get_property_any(subject, [
-            XHV['license'],
-            CC['license'],
-            DCTERMS['license'],
-        ]))
-        self.license.url_property = (XHV['license'] if self.license.url else None)
+        license.url = get_url(self._get_property_any(index, _LICENSE_PROPERTIES))
+        license.url_property = (_XHV_LICENSE if license.url else None)
 
-        if self.license.url:
-            self.license.text = get_license_label(self.license.url)
+        if license.url:
+            license.text = get_license_label(license.url)
         else:
-            self.license.text = None
-
-        if self.license.text is None:
-            self.license.text = self._get_property_any(subject, DC['rights'])
-            self.license.text_property = (DC['rights'] if self.license.text else None)
-            if not self.license.text:
-                self.license.text = self._get_property_any(subject, XHV['license'])
-                self.license.text_property = (XHV['license'] if self.license.text else None)
-
-        source_subjects = list(self.g[subject:DC['source']:]) + list(self.g[subject:DCTERMS['source']:])
-        self.sources = []
-        for s in source_subjects:
-            if isinstance(s, rdflib.URIRef) or isinstance(s, rdflib.BNode):
-                self.sources.append(Credit(rdf, subject=s))
-            elif isinstance(s, rdflib.Literal):
-                url = get_url(s)
-                if url:
-                    self.sources.append(Credit(rdf, subject=s))
+            license.text = None
+
+        if license.text is None:
+            license.text = self._get_property_any(index, _DC_RIGHTS)
+            license.text_property = (_DC_RIGHTS if license.text else None)
+            if not license.text:
+                license.text = self._get_property_any(index, _XHV_LICENSE)
+                license.text_property = (_XHV_LICENSE if license.text else None)
+
+        title.url_property = _intern_property(title.url_property)
+        title.text_property = _intern_property(title.text_property)
+        attrib.url_property = _intern_property(attrib.url_property)
+        attrib.text_property = _intern_property(attrib.text_property)
+        license.url_property = _intern_property(license.url_property)
+        license.text_property = _intern_property(license.text_property)
 
+        self._source_subjects = self._get_source_subjects(index)
 
-        self.title.url_property = ensure_unicode(self.title.url_property) if self.title.url_property else None
-        self.title.text_property = ensure_unicode(self.title.text_property) if self.title.text_property else None
-        self.attrib.url_property = ensure_unicode(self.attrib.url_property) if self.attrib.url_property else None
-        self.attrib.text_property = ensure_unicode(self.attrib.text_property) if self.attrib.text_property else None
-        self.license.url_property = ensure_unicode(self.license.url_property) if self.license.url_property else None
-        self.license.text_property = ensure_unicode(self.license.text_property) if self.license.text_property else None
+        self._graph.extracted[subject] = (title, attrib, license, self._source_subjects)
 
         # TODO: raise an exception if no credit info is found?
 
-    def format(self, formatter, source_depth=1, i18n=_i18n, subject_uri=None):
+    def format(self, formatter, source_depth=1, i18n=_DEFAULT_I18N, subject_uri=None, stats=None):
         """
         Create human-readable credit with the given formatter.
 
         Keyword arguments:
         formatter -- a CreditFormatter to use for output
         source_depth -- maximum depth for source works traversal
-        i18n -- a gettext class with the desired language (domain "libcredit")
+        i18n -- a gettext class with the desired language (domain "libcredit"),
+                or a language code to look up in translation_registry.
+                If omitted, the language of the system locale is used.
+        subject_uri -- passed to formatter.begin()
+        stats -- a CreditStats to add the time spent formatting, the
+                 number of credits formatted, the deepest source level
+                 and the size of the output to
         """
+        if i18n is _DEFAULT_I18N:
+            i18n = translation_registry.get()
+        elif isinstance(i18n, basestring):
+            i18n = translation_registry.get(i18n)
 
-        markup = CREDIT_MARKUP[(
+        if stats is None:
+            self._format(formatter, source_depth, i18n, subject_uri, None, 0, set())
+        else:
+            start = _timer()
+            # Formatters that don't derive from CreditFormatter may
+            # not have measure_output()
+            measure_output = getattr(formatter, 'measure_output', None)
+            size = [0]
+            def count(text):
+                size[0] += len(text.encode('utf-8'))
+            if measure_output is not None:
+                measure_output(count)
+            try:
+                self._format(formatter, source_depth, i18n, subject_uri, stats, 0, set())
+            finally:
+                if measure_output is not None:
+                    measure_output(None)
+            stats.bytes_emitted += size[0]
+            stats.add_time('format', _timer() - start)
+
+    def _format(self, formatter, source_depth, i18n, subject_uri, stats, depth, walking):
+        if stats is not None:
+            stats.credits_formatted += 1
+            if depth > stats.max_depth:
+                stats.max_depth = depth
+
+        key = (
             bool(self.title.text),
             bool(self.attrib.url) or bool(self.attrib.text),
             bool(self.license.url) or bool(self.license.text)
-        )]
+        )
 
-        if not markup:
-            markup = ""
-            #return # TODO: raise an exception instead?
-
-        if i18n:
-            markup = i18n.lgettext(markup)
-            if markup:
-                markup = ensure_unicode(markup)
+        # Templates are translated and split only once per translation
+        templates = _get_templates(i18n)
+        template = templates.get(key)
+        if template is None:
+            template = templates[key] = _compile_template(key, i18n)
 
         formatter.begin(subject_uri=subject_uri)
 
-        for item in ITEM_RE.split(markup):
-            if item == u'<title>':
+        for item, text in template:
+            if item is None:
+                formatter.add_text(text)
+            elif item == 'title':
                 formatter.add_title(self.title)
-            elif item == u'<attrib>':
+            elif item == 'attrib':
                 if isinstance(self.attrib.text, (list, tuple)):
                     for a, author in enumerate(self.attrib.text):
                         attrib = CreditToken(text=author)
@@ -325,84 +1351,415 @@ class Credit(object):
                             formatter.add_text(u", ")
                 else:
                     formatter.add_attrib(self.attrib)
-            elif item == u'<license>':
+            elif item == 'license':
                 formatter.add_license(self.license)
-            else:
-                formatter.add_text(item)
 
-        if self.sources and source_depth != 0:
-            if i18n:
-                source_string = ensure_unicode(i18n.lngettext(
-                        'Source:', 'Sources:', len(self.sources)))
-            else:
-                source_string = 'Sources:' if len(self.sources) > 1 else 'Source:'
+        # A source that leads back to a work that is being formatted
+        # would create a cycle, so it is left out
+        sources = []
+        if source_depth != 0:
+            walking.add(id(self))
+            sources = [s for s in self.sources if id(s) not in walking]
+
+        if sources:
+            label_key = ('sources', len(sources))
+            source_string = templates.get(label_key)
+            if source_string is None:
+                source_string = templates[label_key] = _get_source_label(len(sources), i18n)
 
             formatter.begin_sources(source_string)
 
-            for s in self.sources:
+            for s in sources:
                 formatter.begin_source()
-                s.format(formatter, source_depth - 1, i18n, s.get_subject_uri())
+                s._format(formatter, source_depth - 1, i18n, s.get_subject_uri(), stats, depth + 1, walking)
                 formatter.end_source()
 
             formatter.end_sources()
 
+        if source_depth != 0:
+            walking.discard(id(self))
+
         formatter.end()
 
     def get_subject_uri(self):
         return ensure_unicode(self.subject)
 
-    def _get_property_any(self, subject, properties):
-        subject = a2uri(subject)
+    def freeze(self):
+        """
+        Return a copy of the credit and its whole source tree that
+        does not refer to the RDF graph.  The copy only holds plain
+        strings, so it can be cached or pickled without keeping the
+        triples of the document around.  format() works on it as on
+        any other credit, and its g is None.
+
+        Sources that are shared by several works in this tree are
+        also shared in the copy.  Lazy credits are extracted in full.
+        """
+        frozen = {id(self): self._detach()}
+        stack = [self]
+
+        while stack:
+            credit = stack.pop()
+            sources = frozen[id(credit)]._sources
+            for source in credit.sources:
+                copy = frozen.get(id(source))
+                if copy is None:
+                    copy = frozen[id(source)] = source._detach()
+                    stack.append(source)
+                sources.append(copy)
+
+        return frozen[id(self)]
+
+    def _detach(self):
+        """
+        Return a graph-free copy of this credit without its sources.
+        """
+        credit = Credit.__new__(type(self))
+        credit.g = credit._graph = None
+        credit.subject = ensure_unicode(self.subject)
+        credit._title = self.title._freeze()
+        credit._attrib = self.attrib._freeze()
+        credit._license = self.license._freeze()
+        credit._sources = []
+        credit._source_subjects = ()
+        credit._credits = None
+        return credit
+
+    def __getstate__(self):
+        # Pickle the source tree as the flat node table of
+        # serialize_credit(), so that the graph is left behind and
+        # pickle doesn't recurse once per source level
+        return (SERIALIZATION_VERSION, _get_credit_nodes(self))
+
+    def __setstate__(self, state):
+        version, nodes = state
+        if version != SERIALIZATION_VERSION:
+            raise ValueError('not a pickled credit of version %d' % SERIALIZATION_VERSION)
+        _load_credit_nodes(nodes, self)
+
+    def _set_frozen(self, subject, title, attrib, license, sources):
+        self.subject = subject
+        self._title = title
+        self._attrib = attrib
+        self._license = license
+        self._sources = sources
+        self.g = self._graph = None
+        self._source_subjects = ()
+        self._credits = None
+
+    def _get_source_subjects(self, index):
+        result = []
+        for s in self._get_values(index, _SOURCE_PROPERTIES):
+            if isinstance(s, rdflib.URIRef) or isinstance(s, rdflib.BNode):
+                result.append(a2uri(s))
+            elif isinstance(s, rdflib.Literal):
+                url = get_url(s)
+                if url:
+                    result.append(a2uri(s))
+        return result
+
+    def _load_sources(self):
+        """
+        Build the credits for the whole source graph of the work.
+
+        The graph is walked with an explicit stack, so long source
+        chains do not hit the recursion limit.  Each subject is only
+        extracted once and its credit is shared by all works that list
+        it as a source, so the sources can lead back to a work if the
+        graph has cycles.  format() leaves those out, the same way in
+        eager and lazy mode.
 
+        Returns the number of source credits.
+        """
+        self._sources = []
+        credits = {self.subject: self}
+        stack = [self]
+
+        while stack:
+            credit = stack.pop()
+            for s in credit._source_subjects:
+                source = credits.get(s)
+                if source is None:
+                    source = credits[s] = Credit._from_graph(self._graph, s)
+                    stack.append(source)
+                credit._sources.append(source)
+
+        return len(credits) - 1
+
+    def _get_values(self, index, properties):
+        result = []
+        for property in properties:
+            result += index.get(property, [])
+        return result
+
+    def _get_property_any(self, index, properties):
         if not isinstance(properties, list):
             properties = [properties]
 
         for property in properties:
-            property = a2uri(property)
-
-            try:
-                value = next(self.g[rdflib.URIRef(subject):rdflib.URIRef(property):])
+            values = index.get(property)
+            if values:
+                value = values[0]
                 if value:
-                    if self._is_container(value):
-                        return self._parse_container(value)
+                    if self._graph.is_container(value):
+                        return self._graph.parse_container(value)
                     else:
                         return ensure_unicode(value)
-            except StopIteration:
-                pass
 
-    def _get_property_all(self, subject, properties):
-        subject = a2uri(subject)
+    def _get_property_all(self, index, properties):
         result = []
 
-        if not isinstance(properties, list):
-            properties = [properties]
+        for value in self._get_values(index, properties):
+            if self._graph.is_container(value):
+                items = self._graph.parse_container(value)
+                # An rdf:Alt gives a single member, or None if it is empty
+                if isinstance(items, list):
+                    result += items
+                elif items is not None:
+                    result.append(items)
+            else:
+                result.append(ensure_unicode(value))
 
-        for property in properties:
-            property = a2uri(property)
+        return result
 
-            for value in self.g[rdflib.URIRef(subject):rdflib.URIRef(property):]:
-                if self._is_container(value):
-                    result += self._parse_container(value)
-                else:
-                    result.append(ensure_unicode(value))
 
+def get_credits(rdf, subjects):
+    """
+    Return a list of Credit objects, one for each subject, all
+    extracted from the same graph.  If rdf is a string it is parsed
+    only once.
+
+    Parameters:
+    rdf -- rdflib graph or a string of RDF/XML to parse.
+    subjects -- list of URIs for querying works in the graph
+    """
+    return list(Credit.extract_many(rdf, subjects))
+
+
+# Clock for CreditStats
+_timer = getattr(time, 'perf_counter', time.time)
+
+class CreditStats(object):
+    """
+    Counters and timings of extracting and formatting credits, filled
+    in by Credit() and Credit.format() when passed as stats.  One
+    object can collect the numbers of any number of credits.  Without
+    a stats object nothing is measured.
+
+    The graph lookups and container detection are only counted, not
+    timed, since timing each of them would slow down every credit.
+
+    Members:
+    times -- dict of seconds spent per stage: "parse", "extract" for
+             the fields of the work, "sources" for walking and
+             extracting its source works, and "format"
+    graph_queries -- number of queries made on rdflib graphs
+    container_queries -- how many of graph_queries were made to find
+                         and read RDF containers and collections
+    subjects_extracted -- number of works whose fields were extracted
+    sources -- number of source credits built
+    cache_hits -- number of credits found in a CreditCache
+    credits_formatted -- number of credits and sources formatted
+    max_depth -- deepest source level formatted, 0 for the work itself
+    bytes_emitted -- UTF-8 size of the output of the formatters,
+                     including markup, as reported through
+                     CreditFormatter.measure_output()
+    """
+    def __init__(self):
+        self.times = {}
+        self.graph_queries = 0
+        self.container_queries = 0
+        self.subjects_extracted = 0
+        self.sources = 0
+        self.cache_hits = 0
+        self.credits_formatted = 0
+        self.max_depth = 0
+        self.bytes_emitted = 0
+
+    def add_time(self, stage, seconds):
+        self.times[stage] = self.times.get(stage, 0.0) + seconds
+
+    def as_dict(self):
+        """
+        Return all numbers as a flat dict, e.g. for a metrics system.
+        Times are named "<stage>_seconds".
+        """
+        result = dict(('%s_seconds' % stage, t) for stage, t in self.times.items())
+        for name in ('graph_queries', 'container_queries', 'subjects_extracted', 'sources', 'cache_hits',
+                     'credits_formatted', 'max_depth', 'bytes_emitted'):
+            result[name] = getattr(self, name)
         return result
 
-    def _is_container(self, subject):
-        if (subject, RDF.type, RDF.Alt) in self.g or \
-           (subject, RDF.type, RDF.Seq) in self.g or \
-           (subject, RDF.type, RDF.Bag) in self.g:
-            return True
 
-    def _parse_container(self, subject):
-        result = []
-        for item in rdflib.graph.Seq(self.g, subject):
-            result.append(ensure_unicode(item))
-        if (subject, RDF.type, RDF.Alt) in self.g:
-            return result[0]
+# Version of the format written by serialize_credit()
+SERIALIZATION_VERSION = 1
+
+def _get_credit_nodes(credit):
+    """
+    Return credit and its source tree as a flat list of nodes, where
+    each source is given by its index in the list, so that sources
+    shared by several works are only stored once.  The first node is
+    credit.
+    """
+    queue = [credit]
+    ids = {id(credit): 0}
+    nodes = []
+
+    while len(nodes) < len(queue):
+        c = queue[len(nodes)]
+        sources = []
+        for s in c.sources:
+            n = ids.get(id(s))
+            if n is None:
+                n = ids[id(s)] = len(queue)
+                queue.append(s)
+            sources.append(n)
+
+        tokens = [c.title._freeze(), c.attrib._freeze(), c.license._freeze()]
+        nodes.append([c.get_subject_uri()] +
+                     [[t.text, t.url, t.text_property, t.url_property] for t in tokens] +
+                     [sources])
+
+    return nodes
+
+def _load_credit_nodes(nodes, root=None):
+    """
+    Return the frozen credit of the first of nodes from
+    _get_credit_nodes().  If root is given, that credit is set up as
+    the first one instead of a new one.
+    """
+    credits = []
+    for subject, title, attrib, license, sources in nodes:
+        credit = root if root is not None and not credits else Credit.__new__(Credit)
+        credit._set_frozen(
+            subject,
+            CreditToken(title[0], title[1], _intern_property(title[2]), _intern_property(title[3])),
+            CreditToken(attrib[0], attrib[1], _intern_property(attrib[2]), _intern_property(attrib[3])),
+            CreditToken(license[0], license[1], _intern_property(license[2]), _intern_property(license[3])),
+            sources)
+        credits.append(credit)
+
+    for credit in credits:
+        credit._sources = [credits[n] for n in credit._sources]
+    return credits[0]
+
+def serialize_credit(credit):
+    """
+    Return credit and its source tree as a compact JSON string.
+
+    The credits are stored in a flat list of nodes, where each source
+    is given by its index in the list, so that sources shared by
+    several works are only stored once.  The first node is credit.
+    """
+    return json.dumps({'version': SERIALIZATION_VERSION, 'nodes': _get_credit_nodes(credit)},
+                      separators=(',', ':'))
+
+def deserialize_credit(data):
+    """
+    Return a frozen Credit from a string written by serialize_credit().
+    Raises ValueError if data is not a credit in the current format.
+    """
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    doc = json.loads(data)
+    if not isinstance(doc, dict) or doc.get('version') != SERIALIZATION_VERSION:
+        raise ValueError('not a serialized credit of version %d' % SERIALIZATION_VERSION)
+
+    try:
+        return _load_credit_nodes(doc['nodes'])
+    except (KeyError, IndexError, TypeError, ValueError):
+        raise ValueError('malformed serialized credit')
+
+
+class CreditCache(object):
+    """
+    A cache of extracted credits, keyed by a hash of the RDF document
+    and the subject.  Pass it to Credit() to skip parsing documents
+    that have been seen before.
+
+    The credits are kept serialized, the most recently used ones in
+    memory and all of them in directory if one is given, so that they
+    can be shared between processes and kept across restarts.
+
+    Keyword arguments:
+    directory -- directory to store the credits in, or None
+    maxsize -- number of credits to keep in memory
+    """
+    def __init__(self, directory=None, maxsize=1024):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._memory = _LRUCache(maxsize)
+
+    @staticmethod
+    def get_key(rdf, subject=None):
+        """
+        Return the cache key for the credit of subject in a string of RDF.
+        """
+        if not isinstance(rdf, bytes):
+            rdf = rdf.encode('utf-8')
+        h = hashlib.sha256(rdf)
+        h.update(('\0%s\0%d' % (ensure_unicode(subject or u''), SERIALIZATION_VERSION)).encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        Return the frozen credit stored under key, or None.
+        """
+        data = self._memory.get(key)
+        if data is None and self.directory:
+            data = self._read(key)
+            if data is not None:
+                self._memory.put(key, data)
+
+        credit = None
+        if data is not None:
+            try:
+                credit = deserialize_credit(data)
+            except ValueError:
+                pass
+
+        if credit is None:
+            self.misses += 1
         else:
-            return result
+            self.hits += 1
+        return credit
 
+    def put(self, key, credit):
+        """
+        Store credit, along with its sources, under key.
+        """
+        data = serialize_credit(credit)
+        self._memory.put(key, data)
+        if self.directory:
+            self._write(key, data)
+
+    def clear(self):
+        """
+        Drop the credits kept in memory.  Files are left in place.
+        """
+        self._memory.clear()
+
+    def _read(self, key):
+        try:
+            with io.open(os.path.join(self.directory, key + '.json'), 'rb') as f:
+                return f.read().decode('utf-8')
+        except (IOError, OSError):
+            return None
+
+    def _write(self, key, data):
+        path = os.path.join(self.directory, key + '.json')
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            with io.open(tmp_path, 'wb') as f:
+                f.write(data.encode('utf-8'))
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            # Another process may have written the same credit first
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
 
 
 class CreditFormatter(object):
@@ -474,50 +1831,118 @@ class CreditFormatter(object):
         "Add any text (e.g. punctuation) in the current context."
         pass
 
+    def measure_output(self, counter):
+        """Pass all output of the formatter to counter, a function
+        taking a string, until this is called again with None.  Used
+        by Credit.format() to measure the output size for CreditStats.
+        Formatters that produce text should override this, the
+        default output isn't measured."""
+        pass
+
+def _counting_write(write, counter):
+    """
+    Return a function that passes text to counter before writing it
+    with write, or just write if counter is None.
+    """
+    if counter is None:
+        return write
+
+    def counting_write(text):
+        counter(text)
+        write(text)
+    return counting_write
+
 class TextCreditFormatter(CreditFormatter):
     """
     Credit formatter that outputs credit as plain text.
+
+    Keyword arguments:
+    stream -- file-like object to write the text to as it is generated.
+              If omitted, the text is collected and returned by get_text().
     """
-    def __init__(self):
-        self.text = u""
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.fragments = []
+        if stream is not None:
+            self._output = stream.write
+        else:
+            self._output = self.fragments.append
+        self.write = self._output
         self.depth = 0
 
+    @property
+    def text(self):
+        return u"".join(self.fragments)
+
     def begin(self, subject_uri=None):
         if self.depth == 0:
-            self.text = u""
+            del self.fragments[:]
 
     def end(self):
         pass
 
     def begin_sources(self, label=None):
         if label:
-            self.text += u" " + label
+            self.write(u" " + label)
         self.depth += 1
 
     def end_sources(self):
         self.depth -= 1
 
     def begin_source(self):
-        self.text += "\n" + ("    " * self.depth) + "* "
+        self.write(u"\n" + (u"    " * self.depth) + u"* ")
 
     def end_source(self):
         pass
 
     def add_title(self, token):
-        self.text += token.text
+        self.write(token.text)
 
     def add_attrib(self, token):
-        self.text += token.text
+        self.write(token.text)
 
     def add_license(self, token):
-        self.text += token.text
+        self.write(token.text)
 
     def add_text(self, text):
-        self.text += text
+        self.write(text)
 
     def get_text(self):
+        """
+        Return the text of the last credit, unless it was written to a stream.
+        """
         return self.text
 
+    def measure_output(self, counter):
+        self.write = _counting_write(self._output, counter)
+
+
+def _get_html_elements(element_overrides):
+    elements = {}
+    elements['root'] = element_overrides.get('root', 'div')
+    elements['credit'] = element_overrides.get('credit', 'p')
+    elements['source_list'] = element_overrides.get('source_list', 'ul')
+    elements['source_item'] = element_overrides.get('source_item', 'li')
+    elements['token_url'] = 'a'
+    elements['token_text'] = 'span'
+    return elements
+
+def _get_html_classes(classes):
+    result = {}
+    result['root'] = classes.get('root', None)
+    result['credit'] = classes.get('credit', None)
+    result['source_list'] = classes.get('source_list', None)
+    result['source_item'] = classes.get('source_item', None)
+    result['title'] = classes.get('title', None)
+    result['attrib'] = classes.get('attrib', None)
+    result['license'] = classes.get('license', None)
+    return result
+
+def _escape_html(text):
+    # Same escaping as minidom uses when serializing
+    return text.replace(u"&", u"&amp;").replace(u"<", u"&lt;"). \
+        replace(u"\"", u"&quot;").replace(u">", u"&gt;")
+
 
 class HTMLCreditFormatter(CreditFormatter):
     """
@@ -535,23 +1960,9 @@ class HTMLCreditFormatter(CreditFormatter):
         self.node_stack = []
         self.subject_stack = []
         self.depth = 0
-
-        self.elements = {}
-        self.elements['root'] = element_overrides.get('root', 'div')
-        self.elements['credit'] = element_overrides.get('credit', 'p')
-        self.elements['source_list'] = element_overrides.get('source_list', 'ul')
-        self.elements['source_item'] = element_overrides.get('source_item', 'li')
-        self.elements['token_url'] = 'a'
-        self.elements['token_text'] = 'span'
-
-        self.classes = {}
-        self.classes['root'] = classes.get('root', None)
-        self.classes['credit'] = classes.get('credit', None)
-        self.classes['source_list'] = classes.get('source_list', None)
-        self.classes['source_item'] = classes.get('source_item', None)
-        self.classes['title'] = classes.get('title', None)
-        self.classes['attrib'] = classes.get('attrib', None)
-        self.classes['license'] = classes.get('license', None)
+        self.elements = _get_html_elements(element_overrides)
+        self.classes = _get_html_classes(classes)
+        self.counter = None
 
     def begin(self, subject_uri=None):
         if self.depth == 0:
@@ -578,7 +1989,7 @@ class HTMLCreditFormatter(CreditFormatter):
         node = self._create_element('source_list')
         if self.subject_stack[0] and self.subject_stack[-1]:
             node.attributes['about'] = self.subject_stack[-1]
-            node.attributes['rel'] = ensure_unicode(DC['source'])
+            node.attributes['rel'] = _DC_SOURCE_URI
         self.node_stack[-1].appendChild(node)
         self.node_stack.append(node)
         self.depth += 1
@@ -616,6 +2027,13 @@ class HTMLCreditFormatter(CreditFormatter):
         else:
             return u''
 
+    def measure_output(self, counter):
+        # The HTML is only written out by get_text(), so the whole
+        # credit is measured when the measuring stops
+        if counter is None and self.counter is not None:
+            self.counter(self.get_text())
+        self.counter = counter
+
     def _create_element(self, key, class_key=None):
         if not class_key:
             class_key = key
@@ -643,12 +2061,712 @@ class HTMLCreditFormatter(CreditFormatter):
             self.node_stack[-1].appendChild(span)
 
 
-if __name__ == '__main__':
-    c = Credit(sys.stdin.read())
-    f = TextCreditFormatter()
-    c.format(f, 10)
-    t = f.get_text()
-    if t:
-        sys.stdout.write(t + '\n')
+class StreamingHTMLCreditFormatter(CreditFormatter):
+    """
+    Credit formatter that outputs credit as HTML like
+    HTMLCreditFormatter, but writes the markup directly instead of
+    building a DOM tree first.  The elements, attributes and text are
+    the same, but the attributes are always written in sorted order,
+    while minidom keeps the order they were set in on Python 3.8 and
+    later.
+
+    Keyword arguments:
+    stream -- file-like object to write the HTML to as it is generated.
+              If omitted, the HTML is collected and returned by get_text().
+    element_overrides -- as for HTMLCreditFormatter
+    classes -- as for HTMLCreditFormatter
+    """
+    def __init__(self, stream=None, element_overrides={}, classes={}):
+        self.stream = stream
+        self.buffer = []
+        if stream is not None:
+            self._output = stream.write
+        else:
+            self._output = self.buffer.append
+        self.write = self._output
+
+        # Open elements as [tag, has_content], the start tag of an
+        # element is not closed until we know if it will be empty
+        self.element_stack = []
+        self.subject_stack = []
+        self.depth = 0
+        self.elements = _get_html_elements(element_overrides)
+        self.classes = _get_html_classes(classes)
+
+    def begin(self, subject_uri=None):
+        if self.depth == 0:
+            del self.buffer[:]
+            self._start_element('root')
+
+        if subject_uri:
+            self._start_element('credit', attributes={'about': subject_uri})
+        else:
+            self._start_element('credit')
+
+        self.subject_stack.append(subject_uri)
+
+    def end(self):
+        self._end_element()
+        self.subject_stack.pop()
+        if not self.subject_stack:
+            self._end_element()
+
+    def begin_sources(self, label=None):
+        if label:
+            self.add_text(u" " + label)
+        if self.subject_stack[0] and self.subject_stack[-1]:
+            self._start_element('source_list', attributes={
+                'about': self.subject_stack[-1],
+                'rel': _DC_SOURCE_URI,
+            })
+        else:
+            self._start_element('source_list')
+        self.depth += 1
+
+    def end_sources(self):
+        self.depth -= 1
+        self._end_element()
+
+    def begin_source(self):
+        self._start_element('source_item')
+
+    def end_source(self):
+        self._end_element()
+
+    def add_title(self, token):
+        self._add_impl(token, class_key='title')
+
+    def add_attrib(self, token):
+        self._add_impl(token, class_key='attrib')
+
+    def add_license(self, token):
+        self._add_impl(token, class_key='license')
+
+    def add_text(self, text):
+        self._start_content()
+        self.write(_escape_html(text))
+
+    def get_text(self):
+        """
+        Return the HTML for the last credit, unless it was written to a stream.
+        """
+        return u''.join(self.buffer)
+
+    def measure_output(self, counter):
+        self.write = _counting_write(self._output, counter)
+
+    def _start_content(self):
+        if self.element_stack and not self.element_stack[-1][1]:
+            self.write(u'>')
+            self.element_stack[-1][1] = True
+
+    def _start_element(self, key, class_key=None, attributes=None):
+        self._start_content()
+
+        attributes = dict(attributes or {})
+        if self.classes.get(class_key or key):
+            attributes['class'] = self.classes[class_key or key]
+
+        tag = self.elements[key]
+        self.write(u'<' + tag)
+        for name in sorted(attributes):
+            self.write(u' %s="%s"' % (name, _escape_html(attributes[name])))
+        self.element_stack.append([tag, False])
+
+    def _end_element(self):
+        tag, has_content = self.element_stack.pop()
+        if has_content:
+            self.write(u'</%s>' % tag)
+        else:
+            self.write(u'/>')
+
+    def _add_impl(self, token, class_key):
+        attributes = {}
+        semantics = self.subject_stack[0] and self.subject_stack[-1]
+
+        if token.url:
+            attributes['href'] = token.url
+            if semantics:
+                if token.url_property:
+                    attributes['rel'] = token.url_property
+                if token.text_property:
+                    attributes['property'] = token.text_property
+            self._start_element('token_url', class_key, attributes)
+        else:
+            if semantics and token.text_property:
+                attributes['property'] = token.text_property
+            # HTMLCreditFormatter doesn't set classes on plain text tokens
+            self._start_element('token_text', attributes=attributes)
+
+        self.add_text(token.text)
+        self._end_element()
+
+
+class TokenCreditFormatter(CreditFormatter):
+    """
+    Credit formatter that records the credit as a flat list of events,
+    which can be rendered later without running Credit.format() again,
+    e.g. by a template or by the JavaScript port.
+
+    Each event is a tuple (kind, depth, text, url, text_property,
+    url_property).  kind is the name of the formatter call: "begin",
+    "end", "begin_sources", "end_sources", "begin_source",
+    "end_source", "title", "attrib", "license" or "text".  depth is 0
+    for the work and one more for each level of sources.  The subject
+    URI of "begin" is in url and the label of "begin_sources" and the
+    string of "text" are in text.  Fields that don't apply are None.
+
+    The events only hold strings, integers and None, so they can be
+    serialised as they are with json or msgpack.
+    """
+    def __init__(self):
+        self.events = []
+        self._add = self.events.append
+        self.depth = 0
+
+    def begin(self, subject_uri=None):
+        if self.depth == 0:
+            del self.events[:]
+        self._add(('begin', self.depth, None, subject_uri, None, None))
+
+    def end(self):
+        self._add(('end', self.depth, None, None, None, None))
+
+    def begin_sources(self, label=None):
+        self._add(('begin_sources', self.depth, label, None, None, None))
+        self.depth += 1
+
+    def end_sources(self):
+        self.depth -= 1
+        self._add(('end_sources', self.depth, None, None, None, None))
+
+    def begin_source(self):
+        self._add(('begin_source', self.depth, None, None, None, None))
+
+    def end_source(self):
+        self._add(('end_source', self.depth, None, None, None, None))
+
+    def add_title(self, token):
+        self._add(('title', self.depth, token.text, token.url,
+                   token.text_property, token.url_property))
+
+    def add_attrib(self, token):
+        self._add(('attrib', self.depth, token.text, token.url,
+                   token.text_property, token.url_property))
+
+    def add_license(self, token):
+        self._add(('license', self.depth, token.text, token.url,
+                   token.text_property, token.url_property))
+
+    def add_text(self, text):
+        self._add(('text', self.depth, text, None, None, None))
+
+    def get_events(self):
+        """
+        Return the events of the last credit.
+        """
+        return self.events
+
+    def get_json(self):
+        """
+        Return the events of the last credit as a JSON array of arrays.
+        """
+        return json.dumps(self.events)
+
+    @staticmethod
+    def replay(events, formatter):
+        """
+        Make the calls recorded in events on another formatter, which
+        then formats the credit as if it was passed to Credit.format().
+        The events can also be lists, e.g. when loaded from JSON.
+        """
+        for kind, depth, text, url, text_property, url_property in events:
+            if kind == 'title':
+                formatter.add_title(CreditToken(text, url, text_property, url_property))
+            elif kind == 'attrib':
+                formatter.add_attrib(CreditToken(text, url, text_property, url_property))
+            elif kind == 'license':
+                formatter.add_license(CreditToken(text, url, text_property, url_property))
+            elif kind == 'text':
+                formatter.add_text(text)
+            elif kind == 'begin':
+                formatter.begin(subject_uri=url)
+            elif kind == 'begin_sources':
+                formatter.begin_sources(text)
+            elif kind in ('end', 'end_sources', 'begin_source', 'end_source'):
+                getattr(formatter, kind)()
+            else:
+                raise ValueError('unknown credit event: %r' % (kind, ))
+
+
+class MultiCreditFormatter(CreditFormatter):
+    """
+    Credit formatter that passes every call on to several formatters,
+    so that one Credit.format() produces the credit in several formats:
+
+        text, html = TextCreditFormatter(), HTMLCreditFormatter()
+        credit.format(MultiCreditFormatter([text, html]))
+
+    Walking the sources, translating the labels and splitting the
+    templates is then done once instead of once per format.
+
+    Keyword arguments:
+    formatters -- the formatters, which are called in this order
+    """
+    def __init__(self, formatters):
+        self.formatters = list(formatters)
+        # The bound methods are looked up once, not on every call
+        methods = lambda name: [getattr(f, name) for f in self.formatters]
+        self._begin = methods('begin')
+        self._end = methods('end')
+        self._begin_sources = methods('begin_sources')
+        self._end_sources = methods('end_sources')
+        self._begin_source = methods('begin_source')
+        self._end_source = methods('end_source')
+        self._add_title = methods('add_title')
+        self._add_attrib = methods('add_attrib')
+        self._add_license = methods('add_license')
+        self._add_text = methods('add_text')
+
+    def begin(self, subject_uri=None):
+        for begin in self._begin:
+            begin(subject_uri=subject_uri)
+
+    def end(self):
+        for end in self._end:
+            end()
+
+    def begin_sources(self, label=None):
+        for begin_sources in self._begin_sources:
+            begin_sources(label)
+
+    def end_sources(self):
+        for end_sources in self._end_sources:
+            end_sources()
+
+    def begin_source(self):
+        for begin_source in self._begin_source:
+            begin_source()
+
+    def end_source(self):
+        for end_source in self._end_source:
+            end_source()
+
+    def add_title(self, token):
+        for add_title in self._add_title:
+            add_title(token)
+
+    def add_attrib(self, token):
+        for add_attrib in self._add_attrib:
+            add_attrib(token)
+
+    def add_license(self, token):
+        for add_license in self._add_license:
+            add_license(token)
+
+    def add_text(self, text):
+        for add_text in self._add_text:
+            add_text(text)
+
+    def measure_output(self, counter):
+        for formatter in self.formatters:
+            measure_output = getattr(formatter, 'measure_output', None)
+            if measure_output is not None:
+                measure_output(counter)
+
+
+class RenderResult(object):
+    """
+    The outcome of rendering one document with render_credits().
+
+    Members:
+    text -- the formatted credit, or None if rendering failed.
+    error -- a description of the error if rendering failed, otherwise None.
+    """
+    def __init__(self, text=None, error=None):
+        self.text = text
+        self.error = error
+
+
+# Translation used by render_credits() worker processes
+_worker_i18n = None
+
+def _init_worker(languages):
+    global _worker_i18n
+    _worker_i18n = get_i18n(languages)
+
+def _render_document(job):
+    document, source_depth, html = job
+    if isinstance(document, tuple):
+        rdf, subject = document
     else:
-        sys.exit('no credit\n')
+        rdf, subject = document, None
+
+    try:
+        credit = Credit(rdf, subject)
+        if html:
+            formatter = StreamingHTMLCreditFormatter()
+        else:
+            formatter = TextCreditFormatter()
+        credit.format(formatter, source_depth, _worker_i18n)
+        return RenderResult(text=formatter.get_text())
+    except Exception as e:
+        return RenderResult(error='%s: %s' % (type(e).__name__, e))
+
+def render_credits(documents, source_depth=1, languages=None, html=False,
+                   processes=None, chunksize=16):
+    """
+    Render the credits of many RDF/XML documents, spread over a pool of
+    worker processes.  Each worker loads the translation once.
+
+    Returns an iterator over a RenderResult for each document, in the
+    same order as the documents.  A document that fails to render
+    gives a result with an error instead of aborting the whole run.
+
+    Keyword arguments:
+    documents -- iterable of RDF/XML strings, or (rdf, subject) tuples
+    source_depth -- maximum depth for source works traversal
+    languages -- list of languages to translate to, default is the system locale
+    html -- if True, render with StreamingHTMLCreditFormatter instead of
+            TextCreditFormatter
+    processes -- number of worker processes, default is the number of CPUs.
+                 If 1, everything is rendered in this process.
+    chunksize -- number of documents handed to a worker at a time
+    """
+    # Fail when called, before starting any workers, if the
+    # translation can't be found
+    get_i18n(languages)
+    return _render_credits(documents, source_depth, languages, html, processes, chunksize)
+
+def _render_credits(documents, source_depth, languages, html, processes, chunksize):
+    jobs = ((document, source_depth, html) for document in documents)
+
+    if processes == 1:
+        _init_worker(languages)
+        for job in jobs:
+            yield _render_document(job)
+        return
+
+    pool = multiprocessing.Pool(processes, _init_worker, (languages, ))
+    try:
+        for result in pool.imap(_render_document, jobs, chunksize):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _render_credit(rdf, subject, source_depth, languages, html,
+                   element_overrides, classes, subject_uri):
+    """
+    Return the credit of subject in rdf formatted as text or HTML, see
+    RenderCache.render().
+    """
+    if html:
+        formatter = StreamingHTMLCreditFormatter(element_overrides=element_overrides,
+                                                 classes=classes)
+    else:
+        formatter = TextCreditFormatter()
+    Credit(rdf, subject).format(formatter, source_depth, get_i18n(languages), subject_uri)
+    return formatter.get_text()
+
+
+class RenderCache(object):
+    """
+    A cache of rendered credits, keyed by a digest of the RDF document
+    and every parameter that affects the output.  Rendering a document
+    that is in the cache skips parsing, extraction and formatting.
+
+    Keyword arguments:
+    maxsize -- maximum number of rendered credits to keep
+    maxbytes -- maximum total UTF-8 size of the rendered credits to
+                keep, or None for no limit
+    ttl -- seconds after which a rendered credit is rendered again,
+           or None to keep it until it is evicted
+
+    Members:
+    hits, misses, evictions, expirations -- counters since creation
+    size -- total UTF-8 size of the kept credits if maxbytes is set
+    """
+    def __init__(self, maxsize=1024, maxbytes=None, ttl=None):
+        self._cache = _LRUCache(maxsize, maxbytes, ttl,
+                                sizeof=lambda text: len(text.encode('utf-8')))
+
+    hits = property(lambda self: self._cache.hits)
+    misses = property(lambda self: self._cache.misses)
+    evictions = property(lambda self: self._cache.evictions)
+    expirations = property(lambda self: self._cache.expirations)
+    size = property(lambda self: self._cache.size)
+
+    def __len__(self):
+        return len(self._cache)
+
+    def clear(self):
+        self._cache.clear()
+
+    def render(self, rdf, subject=None, source_depth=1, languages=None,
+               html=False, element_overrides={}, classes={}, subject_uri=None):
+        """
+        Return the credit of subject in rdf, formatted as text or HTML.
+
+        Keyword arguments:
+        rdf -- a string of RDF/XML
+        subject -- URI of the work, see Credit
+        source_depth -- maximum depth for source works traversal
+        languages -- list of languages to translate to, see get_i18n()
+        html -- if True, format with StreamingHTMLCreditFormatter, otherwise
+                with TextCreditFormatter
+        element_overrides, classes -- passed to StreamingHTMLCreditFormatter
+        subject_uri -- passed to Credit.format()
+        """
+        key = self.get_key(rdf, subject, source_depth, languages, html,
+                           element_overrides, classes, subject_uri)
+        text = self._cache.get(key)
+        if text is None:
+            text = _render_credit(rdf, subject, source_depth, languages, html,
+                                  element_overrides, classes, subject_uri)
+            self._cache.put(key, text)
+        return text
+
+    @staticmethod
+    def get_key(rdf, subject=None, source_depth=1, languages=None, html=False,
+                element_overrides={}, classes={}, subject_uri=None):
+        """
+        Return the cache key for rendering rdf with these parameters.
+        """
+        if not isinstance(rdf, bytes):
+            rdf = rdf.encode('utf-8')
+        options = [subject, source_depth, languages, bool(html), subject_uri]
+        if html:
+            options += [element_overrides, classes]
+        h = hashlib.sha256(rdf)
+        h.update(b'\0')
+        h.update(json.dumps(options, sort_keys=True).encode('utf-8'))
+        return h.hexdigest()
+
+
+def stream_credits(records, output='text', source_depth=1):
+    """
+    Generate a result dict for each of a stream of records, one at a
+    time.  Translations are loaded once per language by get_i18n().
+
+    Each record is a dict with the keys:
+    rdf -- the RDF document
+    subject -- (optional) URI of the work
+    language -- (optional) language to translate the credit to
+    format -- (optional) rdflib parser for the document, default "xml"
+    id -- (optional) copied to the result as-is
+
+    The result holds the credit in the key named by output, or a
+    description of the problem in the key "error".
+
+    Keyword arguments:
+    records -- iterable of record dicts
+    output -- "text", "html" or "tokens", see TokenCreditFormatter
+    source_depth -- maximum depth for source works traversal
+    """
+    for record in records:
+        result = {}
+        if 'id' in record:
+            result['id'] = record['id']
+
+        try:
+            i18n = get_i18n(record.get('language') or None)
+
+            g = Credit.parse(record['rdf'], record.get('format') or 'xml')
+            credit = Credit(g, record.get('subject'))
+
+            if output == 'html':
+                formatter = StreamingHTMLCreditFormatter()
+                credit.format(formatter, source_depth, i18n)
+                result['html'] = formatter.get_text()
+            elif output == 'tokens':
+                formatter = TokenCreditFormatter()
+                credit.format(formatter, source_depth, i18n, credit.get_subject_uri())
+                result['tokens'] = formatter.get_events()
+            else:
+                formatter = TextCreditFormatter()
+                credit.format(formatter, source_depth, i18n)
+                result['text'] = formatter.get_text()
+        except Exception as e:
+            result['error'] = '%s: %s' % (type(e).__name__, e)
+
+        yield result
+
+
+# rdflib parsers for files found in directories and tar archives
+_RDF_FILE_FORMATS = {
+    '.rdf': 'xml',
+    '.xml': 'xml',
+    '.ttl': 'turtle',
+}
+
+def _read_ndjson(f):
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+def _read_records(paths):
+    """
+    Generate records for stream_credits() from NDJSON files,
+    directories and tar archives of RDF files, or single RDF files.
+    Only one document is held in memory at a time.
+    """
+    for path in paths:
+        ext = os.path.splitext(path)[1]
+
+        if ext in ('.ndjson', '.jsonl'):
+            with open(path, 'rb') as f:
+                for record in _read_ndjson(f):
+                    yield record
+
+        elif os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    rdf_format = _RDF_FILE_FORMATS.get(os.path.splitext(filename)[1])
+                    if rdf_format:
+                        name = os.path.join(dirpath, filename)
+                        with open(name, 'rb') as f:
+                            yield {'id': name, 'rdf': f.read(), 'format': rdf_format}
+
+        elif tarfile.is_tarfile(path):
+            tar = tarfile.open(path, 'r|*')
+            try:
+                for member in tar:
+                    rdf_format = _RDF_FILE_FORMATS.get(os.path.splitext(member.name)[1])
+                    if member.isfile() and rdf_format:
+                        rdf = tar.extractfile(member).read()
+                        yield {'id': member.name, 'rdf': rdf, 'format': rdf_format}
+            finally:
+                tar.close()
+
+        else:
+            with open(path, 'rb') as f:
+                yield {'id': path, 'rdf': f.read(), 'format': _RDF_FILE_FORMATS.get(ext, 'xml')}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Print credit for RDF/XML metadata.  '
+        'Reads a single document from stdin if no files are given.')
+    parser.add_argument('files', nargs='*', metavar='FILE',
+                        help='RDF/XML documents to render')
+    parser.add_argument('-d', '--depth', type=int, default=10,
+                        help='maximum depth for source works traversal (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--html', action='store_true',
+                        help='print credit as HTML instead of text')
+    parser.add_argument('--ndjson', action='store_true',
+                        help='stream documents one at a time and print one JSON result per line.  '
+                        'FILE can also be a directory or tar archive of .rdf/.ttl files, '
+                        'or an NDJSON file of records.  Reads NDJSON records from stdin if no '
+                        'files are given.')
+    parser.add_argument('--tokens', action='store_true',
+                        help='with --ndjson, print the credit as a list of token '
+                        'events, see TokenCreditFormatter')
+    parser.add_argument('--serve', type=int, metavar='PORT',
+                        help='render POSTed documents over HTTP on PORT, see '
+                        'libcredit_server.CreditServer')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='with --serve, address to listen on (default: %(default)s)')
+    args = parser.parse_args(argv)
+    if args.tokens and not args.ndjson:
+        parser.error('--tokens can only be used with --ndjson')
+
+    if args.serve is not None:
+        from libcredit_server import CreditServer
+        server = CreditServer(args.host, args.serve, processes=args.jobs,
+                              source_depth=args.depth, log_requests=True)
+        sys.stderr.write('Serving credits on http://%s:%d/\n' % server.server_address)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+        return 0
+
+    if args.ndjson:
+        if args.files:
+            records = _read_records(args.files)
+        else:
+            records = _read_ndjson(sys.stdin)
+
+        if args.tokens:
+            output = 'tokens'
+        elif args.html:
+            output = 'html'
+        else:
+            output = 'text'
+
+        status = 0
+        for result in stream_credits(records, output, args.depth):
+            if 'error' in result:
+                status = 1
+            sys.stdout.write(json.dumps(result, sort_keys=True) + '\n')
+            sys.stdout.flush()
+
+        return status
+
+    if not args.files:
+        c = Credit(sys.stdin.read())
+        if args.html:
+            f = StreamingHTMLCreditFormatter()
+        else:
+            f = TextCreditFormatter()
+        c.format(f, args.depth)
+        t = f.get_text()
+        if t:
+            sys.stdout.write(t + '\n')
+            return 0
+        else:
+            return 'no credit\n'
+
+    # A file that can't be read is reported and skipped, so names
+    # holds the file of each document passed on to render_credits()
+    names = []
+    read_errors = []
+
+    def read_files():
+        for filename in args.files:
+            try:
+                with open(filename, 'rb') as f:
+                    rdf = f.read()
+            except (IOError, OSError) as e:
+                sys.stderr.write('%s: %s: %s\n' % (filename, type(e).__name__, e))
+                read_errors.append(filename)
+                continue
+            names.append(filename)
+            yield rdf
+
+    status = 0
+    results = render_credits(read_files(), args.depth, html=args.html,
+                             processes=args.jobs)
+    for i, result in enumerate(results):
+        if result.error:
+            sys.stderr.write('%s: %s\n' % (names[i], result.error))
+            status = 1
+        elif result.text:
+            sys.stdout.write(result.text + '\n')
+        sys.stdout.flush()
+
+    if read_errors:
+        status = 1
+    return status
+
+
+# The namespaces created on first access must still be exported by
+# "from libcredit import *", while the modules it uses are not
+__all__ = sorted(set(name for name, value in globals().items()
+                     if not name.startswith('_') and
+                     not isinstance(value, (type(sys), _LazyModule))) |
+                 set(_PUBLIC_NAMESPACES) | set(['RDF']))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# libcredit - module for converting RDF metadata to human-readable strings
+#
+# Copyright 2013 Commons Machinery http://commonsmachinery.se/
+#
+# Distributed under an GPLv2 license, please see LICENSE in the top dir.
+
+"""
+asyncio interface to libcredit, for rendering credits from a service
+without blocking its event loop.  Requires Python 3.5 or later.
+"""
+
+import asyncio
+
+import libcredit
+
+
+class AsyncCreditRenderer(object):
+    """
+    Renders credits in an executor, so that parsing and formatting
+    don't block the event loop.
+
+    At most max_concurrency documents are rendered at a time.  Requests
+    for a document and options that are already being rendered wait
+    for that render instead of starting another one, so a burst of
+    identical requests costs a single render.
+
+    The default executor of the loop runs the renders in threads,
+    which keeps the loop responsive.  Pass a
+    concurrent.futures.ProcessPoolExecutor to also render in parallel.
+
+    Keyword arguments:
+    executor -- concurrent.futures.Executor to render in, or None for
+                the default executor of the event loop
+    max_concurrency -- maximum number of renders at a time, or None
+                       for no limit
+
+    Members:
+    renders -- number of renders started
+    coalesced -- number of requests that waited for a render already
+                 in progress
+    """
+    def __init__(self, executor=None, max_concurrency=None):
+        self.executor = executor
+        self.max_concurrency = max_concurrency
+        self.renders = 0
+        self.coalesced = 0
+        self._semaphore = None
+        self._in_flight = {}
+
+    async def render(self, rdf, subject=None, source_depth=1, languages=None,
+                     html=False, element_overrides={}, classes={}, subject_uri=None):
+        """
+        Return the credit of subject in rdf, formatted as text or HTML.
+        Takes the same arguments as libcredit.RenderCache.render().
+        """
+        args = (rdf, subject, source_depth, languages, html,
+                element_overrides, classes, subject_uri)
+        key = libcredit.RenderCache.get_key(*args)
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._render(args))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda task: self._in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+
+        # A cancelled request must not cancel the render that other
+        # requests are waiting for
+        return await asyncio.shield(task)
+
+    async def render_many(self, documents, source_depth=1, languages=None,
+                          html=False, element_overrides={}, classes={}):
+        """
+        Render the credits of many documents, as render_credits() does.
+        Returns a list of libcredit.RenderResult in the same order as
+        the documents.
+
+        Keyword arguments:
+        documents -- iterable of RDF/XML strings, or (rdf, subject) tuples
+        The others are passed to render().
+        """
+        async def render_result(document):
+            if isinstance(document, tuple):
+                rdf, subject = document
+            else:
+                rdf, subject = document, None
+            try:
+                text = await self.render(rdf, subject, source_depth, languages,
+                                         html, element_overrides, classes)
+                return libcredit.RenderResult(text=text)
+            except Exception as e:
+                return libcredit.RenderResult(error='%s: %s' % (type(e).__name__, e))
+
+        return await asyncio.gather(*[render_result(d) for d in documents])
+
+    async def _render(self, args):
+        if self.max_concurrency is None:
+            return await self._run(args)
+
+        # Created here so that it belongs to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            return await self._run(args)
+
+    async def _run(self, args):
+        self.renders += 1
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, libcredit._render_credit, *args)
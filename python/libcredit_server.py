@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+# libcredit - module for converting RDF metadata to human-readable strings
+#
+# Copyright 2013 Commons Machinery http://commonsmachinery.se/
+#
+# Distributed under an GPLv2 license, please see LICENSE in the top dir.
+
+"""
+HTTP server that renders credits with libcredit, see CreditServer.
+Started from the command line with: python libcredit.py --serve PORT
+"""
+
+import bisect
+import json
+import multiprocessing
+import sys
+import threading
+import time
+
+if sys.version_info[0] >= 3:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    import urllib.parse as urlparse
+else:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    import urlparse
+
+import libcredit
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+
+class LatencyHistogram(object):
+    """
+    Counts durations in buckets with fixed upper bounds.  Can be
+    updated from several threads at once.
+
+    Keyword arguments:
+    bounds -- increasing upper bounds of the buckets, in seconds.
+              Longer durations are counted in a last, unbounded bucket.
+
+    Members:
+    counts -- number of durations per bucket
+    count, total, max -- number, sum and maximum of all durations
+    """
+    DEFAULT_BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                      0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        i = bisect.bisect_left(self.bounds, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, p):
+        """
+        Return the upper bound of the bucket holding the p:th
+        percentile (0-100), the largest duration if it is in the last
+        bucket, or None if nothing has been counted.
+        """
+        if not self.count:
+            return None
+        rank = self.count * p / 100.0
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def as_dict(self):
+        """
+        Return the histogram as a dict that can be serialised as JSON.
+        The bound of the last bucket is None.
+        """
+        with self._lock:
+            counts = list(self.counts)
+        return {
+            'count': self.count,
+            'total_seconds': self.total,
+            'max_seconds': self.max,
+            'p50_seconds': self.percentile(50),
+            'p90_seconds': self.percentile(90),
+            'p99_seconds': self.percentile(99),
+            'buckets': [{'le': bound, 'count': count}
+                        for bound, count in zip(self.bounds + (None, ), counts)],
+        }
+
+
+# RDF/XML rendered by each server worker before it takes any requests
+_WARM_UP_RDF = u"""<?xml version="1.0" encoding="utf-8"?>
+<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+         xmlns:dc="http://purl.org/dc/elements/1.1/">
+  <rdf:Description rdf:about="urn:warm-up">
+    <dc:title>warm-up</dc:title>
+  </rdf:Description>
+</rdf:RDF>"""
+
+def _warm_up(languages):
+    """
+    Load the translations, rdflib and its RDF/XML parser, so that the
+    first request to a worker is as fast as the rest.
+    """
+    libcredit.translation_registry.preload(languages)
+    libcredit.get_i18n()
+    g = libcredit.Credit.parse(_WARM_UP_RDF)
+    libcredit.Credit(g, u'urn:warm-up').format(libcredit.TextCreditFormatter())
+
+def _serve_record(job):
+    record, output, source_depth = job
+    return next(libcredit.stream_credits([record], output, source_depth))
+
+
+class _CreditRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles the requests of a CreditServer, which is the credit_server
+    of the HTTP server.
+    """
+    # Keep connections open between requests, and send responses
+    # without waiting for the client to acknowledge the previous one
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.credit_server = self.server.credit_server
+        self.credit_server._count('connections')
+
+    def do_GET(self):
+        if urlparse.urlsplit(self.path).path == '/stats':
+            self._send(200, 'application/json',
+                       json.dumps(self.credit_server.get_stats(), sort_keys=True))
+        else:
+            self._send(404, 'text/plain', u'not found\n')
+
+    def do_POST(self):
+        start = _timer()
+        try:
+            self._handle_render()
+        finally:
+            self.credit_server.latency.add(_timer() - start)
+
+    def _handle_render(self):
+        server = self.credit_server
+        server._count('requests')
+
+        url = urlparse.urlsplit(self.path)
+        if url.path != '/render':
+            self.close_connection = True
+            return self._send(404, 'text/plain', u'not found\n')
+
+        try:
+            length = int(self.headers.get('Content-Length'))
+        except (TypeError, ValueError):
+            self.close_connection = True
+            return self._send(411, 'text/plain', u'Content-Length required\n')
+        if length < 0:
+            self.close_connection = True
+            return self._send(400, 'text/plain', u'invalid Content-Length\n')
+        if length > server.max_request_size:
+            self.close_connection = True
+            return self._send(413, 'text/plain', u'request too large\n')
+        body = self.rfile.read(length)
+
+        params = dict((k, v[-1]) for k, v in urlparse.parse_qs(url.query).items())
+        output = params.pop('output', 'text')
+        if output not in ('text', 'html', 'tokens'):
+            return self._send(400, 'text/plain', u'unknown output: %s\n' % output)
+        try:
+            source_depth = int(params.pop('depth', server.source_depth))
+        except ValueError:
+            return self._send(400, 'text/plain', u'depth must be an integer\n')
+
+        content_type = self.headers.get('Content-Type') or ''
+        if content_type.split(';')[0].strip() == 'application/json':
+            try:
+                data = json.loads(body.decode('utf-8'))
+            except ValueError as e:
+                return self._send(400, 'text/plain', u'invalid JSON: %s\n' % e)
+            batch = isinstance(data, list)
+            records = data if batch else [data]
+            if not all(isinstance(r, dict) and 'rdf' in r for r in records):
+                return self._send(400, 'text/plain',
+                                  u'expected a record or a list of records with "rdf"\n')
+            # Parameters in the URL are defaults for the records
+            for record in records:
+                for key, value in params.items():
+                    record.setdefault(key, value)
+        else:
+            batch = None
+            params['rdf'] = body
+            records = [params]
+
+        results = server.render(records, output, source_depth)
+        errors = len([r for r in results if 'error' in r])
+        server._count('documents', len(results))
+        server._count('errors', errors)
+
+        if batch:
+            self._send(200, 'application/json', json.dumps(results, sort_keys=True))
+        elif batch is not None:
+            self._send(422 if errors else 200, 'application/json',
+                       json.dumps(results[0], sort_keys=True))
+        elif errors:
+            self._send(422, 'text/plain', results[0]['error'] + u'\n')
+        elif output == 'tokens':
+            self._send(200, 'application/json', json.dumps(results[0]['tokens'], sort_keys=True))
+        elif output == 'html':
+            self._send(200, 'text/html', results[0]['html'])
+        else:
+            self._send(200, 'text/plain', results[0]['text'])
+
+    def _send(self, status, content_type, text):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.credit_server.log_requests:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class _HTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class CreditServer(object):
+    """
+    HTTP server that renders credits for POSTed RDF documents.  Each
+    connection is handled in its own thread and kept open between
+    requests.  Documents are rendered by a pool of worker processes
+    that have loaded rdflib and the translations before the first
+    request, or in the connection threads if processes is 1.
+
+    POST /render renders a document.  The body is either the RDF
+    document itself, or a JSON record or list of records as read by
+    libcredit.stream_credits() (sent as application/json).  The URL
+    parameters are:
+
+    output -- "text" (default), "html" or "tokens", see TokenCreditFormatter
+    depth -- maximum depth for source works traversal
+    subject, language, format -- defaults for the records, see
+                                 libcredit.stream_credits()
+
+    A single document is answered with the credit as text/plain,
+    text/html or JSON tokens, or status 422 if it could not be
+    rendered.  A JSON record is answered with its result dict, and a
+    list of records with a list of result dicts.
+
+    GET /stats returns the counters and the latency histogram of the
+    render requests as JSON.
+
+    Keyword arguments:
+    host, port -- address to listen on, port 0 picks a free port
+    processes -- number of worker processes, default is the number of
+                 CPUs.  If 1, documents are rendered in the server process.
+    languages -- language codes to load translations for up front
+    source_depth -- default maximum depth for source works traversal
+    max_request_size -- largest request body accepted, in bytes
+    log_requests -- if True, log each request to stderr
+
+    Members:
+    server_address -- (host, port) the server listens on
+    latency -- LatencyHistogram of the render requests
+    """
+    def __init__(self, host='127.0.0.1', port=0, processes=None, languages=(),
+                 source_depth=10, max_request_size=16 * 1024 * 1024, log_requests=False):
+        self.source_depth = source_depth
+        self.max_request_size = max_request_size
+        self.log_requests = log_requests
+        self.latency = LatencyHistogram()
+        self._counters = {'connections': 0, 'requests': 0, 'documents': 0, 'errors': 0}
+        self._lock = threading.Lock()
+
+        languages = list(languages)
+        if processes == 1:
+            _warm_up(languages)
+            self._pool = None
+        else:
+            self._pool = multiprocessing.Pool(processes, _warm_up, (languages, ))
+
+        try:
+            self._httpd = _HTTPServer((host, port), _CreditRequestHandler)
+        except:
+            self._close_pool()
+            raise
+        self._httpd.credit_server = self
+        self.server_address = self._httpd.server_address[:2]
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def serve_forever(self):
+        """Handle requests until shutdown() is called."""
+        self._httpd.serve_forever()
+
+    def start(self):
+        """Handle requests in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def shutdown(self):
+        """Stop serve_forever(), running in another thread."""
+        self._httpd.shutdown()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        """Stop serving and release the socket and the worker pool."""
+        if self._thread:
+            self.shutdown()
+        self._httpd.server_close()
+        self._close_pool()
+
+    def render(self, records, output='text', source_depth=None):
+        """
+        Render a list of records, see libcredit.stream_credits(), in the worker
+        pool.  Returns a list of result dicts in the same order.
+        """
+        if source_depth is None:
+            source_depth = self.source_depth
+        jobs = [(record, output, source_depth) for record in records]
+        if self._pool is None:
+            return [_serve_record(job) for job in jobs]
+        if len(jobs) == 1:
+            return [self._pool.apply(_serve_record, jobs)]
+        return self._pool.map(_serve_record, jobs)
+
+    def get_stats(self):
+        """
+        Return the counters of connections, requests, documents and
+        documents that could not be rendered, and the latency
+        histogram of the render requests, as a dict.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        stats['latency'] = self.latency.as_dict()
+        return stats
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def _close_pool(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+# libcredit - module for converting RDF metadata to human-readable strings
+#
+# Copyright 2013 Commons Machinery http://commonsmachinery.se/
+#
+# Distributed under an GPLv2 license, please see LICENSE in the top dir.
+
+import rdflib
+
+def load_rdfxml(filename):
+    """Return a testcase converted from turtle to RDF/XML."""
+    g = rdflib.Graph()
+    with open('../testcases/' + filename + '.ttl') as f:
+        g.parse(f, format="n3")
+    return g.serialize(format="xml")
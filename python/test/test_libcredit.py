@@ -10,11 +10,24 @@
 
 import unittest
 
+import io
+import json
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import weakref
 import gettext
+from xml.dom import minidom
 import rdflib
 import libcredit
 from libcredit import ensure_unicode
 
+from .helpers import load_rdfxml
+
 class TestCreditFormatter(libcredit.CreditFormatter):
     def __init__(self):
         self.source_stack = []
@@ -74,6 +87,37 @@ def load_output(filename):
     expected.sort()
     return expected
 
+# A document with a title for the default subject
+TITLE_RDFXML = """<?xml version="1.0" encoding="utf-8"?>
+<rdf:RDF xmlns:dc="http://purl.org/dc/elements/1.1/"
+         xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about="">
+    <dc:source rdf:resource="urn:src"/>
+  </rdf:Description>
+  <rdf:Description rdf:about="urn:src">
+    <dc:title>a title</dc:title>
+  </rdf:Description>
+</rdf:RDF>
+"""
+
+def run_main(args):
+    """Run libcredit as a script, returning the exit status, stdout and stderr."""
+    proc = subprocess.Popen([sys.executable, 'libcredit.py'] + args,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    return proc.returncode, out.decode('utf-8'), err.decode('utf-8')
+
+class CountingGraph(rdflib.Graph):
+    """Graph that counts the lookups of anything but rdf:type."""
+    def __init__(self):
+        rdflib.Graph.__init__(self)
+        self.lookups = 0
+
+    def triples(self, triple):
+        if triple[1] != rdflib.RDF.type:
+            self.lookups += 1
+        return rdflib.Graph.triples(self, triple)
+
 class LibCreditTests(unittest.TestCase):
     def _test_credit_output(self, tests):
         for filename_prefix, uri in tests:
@@ -102,6 +146,57 @@ class LibCreditTests(unittest.TestCase):
         self.assertEqual(libcredit.get_license_label('http://some/rights/statement'),
             'http://some/rights/statement')
 
+    def test_license_label_resolver(self):
+        resolver = libcredit.LicenseLabelResolver(cache_size=2)
+        resolver.register('http://www.gnu.org/licenses/gpl-3.0', 'GPL 3.0')
+        resolver.register('https://opendatacommons.org/licenses/odbl/',
+                          lambda url: 'ODbL ' + url.rstrip('/').split('/')[-1])
+
+        self.assertEqual(resolver.get_label('https://www.gnu.org/licenses/gpl-3.0.en.html'), 'GPL 3.0')
+        self.assertEqual(resolver.get_label('http://gnu.org/licenses/gpl-3.0'), 'GPL 3.0')
+        self.assertEqual(resolver.get_label('http://opendatacommons.org/licenses/odbl/1.0/'), 'ODbL 1.0')
+        self.assertEqual(resolver.get_label('http://www.gnu.org/licenses/gpl-2.0.html'),
+            'http://www.gnu.org/licenses/gpl-2.0.html')
+        self.assertEqual(resolver.get_label('http://creativecommons.org/licenses/by-sa/3.0/'),
+            'CC BY-SA 3.0 Unported')
+        self.assertEqual(resolver.misses, 5)
+        self.assertEqual(resolver.hits, 0)
+
+        self.assertEqual(resolver.get_label('http://creativecommons.org/licenses/by-sa/3.0/'),
+            'CC BY-SA 3.0 Unported')
+        self.assertEqual(resolver.hits, 1)
+        self.assertEqual(len(resolver._cache), 2)
+
+    def test_license_label_invalid_url(self):
+        self.assertEqual(libcredit.get_license_label('http://[oops/license'), 'http://[oops/license')
+
+        g = rdflib.Graph()
+        subject = rdflib.URIRef('http://[oops/work')
+        g.add((subject, libcredit.XHV['license'], rdflib.URIRef('http://[oops/license')))
+        credit = libcredit.Credit(g, subject)
+        self.assertEqual(credit.license.text, 'http://[oops/license')
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'the namespace constants need rdflib at import')
+    def test_lazy_imports(self):
+        code = ('import sys, libcredit; libcredit.get_license_label("http://artlibre.org/licence/lal"); '
+                'sys.exit(len([m for m in ("rdflib", "xml.dom.minidom", "gettext") if m in sys.modules]))')
+        self.assertEqual(subprocess.call([sys.executable, '-c', code]), 0)
+
+    def test_namespaces(self):
+        from libcredit import DC, DCTERMS, RDF
+        self.assertTrue(isinstance(DC, rdflib.Namespace))
+        self.assertEqual(DC.title, rdflib.URIRef('http://purl.org/dc/elements/1.1/title'))
+        self.assertEqual(DCTERMS.title, rdflib.URIRef('http://purl.org/dc/terms/title'))
+        self.assertEqual(DC['source'], rdflib.URIRef('http://purl.org/dc/elements/1.1/source'))
+        self.assertTrue(RDF is rdflib.RDF)
+
+        namespace = {}
+        exec('from libcredit import *', namespace)
+        for name in ('DC', 'DCTERMS', 'CC', 'XHV', 'OG', 'RDF', 'Credit'):
+            self.assertTrue(name in namespace, name)
+        self.assertTrue('DC' in dir(libcredit))
+        self.assertFalse('sys' in namespace or 'rdflib' in namespace)
+
     def test_empty(self):
         credit = load_credit('nothing', 'urn:src')
         format = format_credit(credit)
@@ -153,6 +248,496 @@ class LibCreditTests(unittest.TestCase):
             ('source-with-full-attrib', 'http://src/'),
         ])
 
+    def test_parse_once(self):
+        rdf = load_rdfxml('sources-with-sources')
+        libcredit.Credit.parse_count = 0
+        credit = libcredit.Credit(rdf, 'http://src/')
+        self.assertEqual(libcredit.Credit.parse_count, 1)
+        self.assertEqual(format_credit(credit), load_output('sources-with-sources'))
+
+    def test_get_credits(self):
+        rdf = load_rdfxml('sources-uris')
+        libcredit.Credit.parse_count = 0
+        credits = libcredit.get_credits(rdf, ['http://src/', 'http://subsrc-1/'])
+        self.assertEqual(libcredit.Credit.parse_count, 1)
+        self.assertEqual(len(credits), 2)
+        self.assertTrue(credits[0].g is credits[1].g)
+        self.assertEqual(credits[1].title.text, 'http://subsrc-1/')
+
+    def test_source_cycle(self):
+        g = rdflib.Graph()
+        a = rdflib.URIRef('http://a/')
+        b = rdflib.URIRef('http://b/')
+        g.add((a, libcredit.DC['source'], b))
+        g.add((b, libcredit.DC['source'], a))
+        credit = libcredit.Credit(g, a)
+        self.assertEqual(len(credit.sources), 1)
+        self.assertEqual(credit.sources[0].get_subject_uri(), 'http://b/')
+        # the shared credits lead back to the work, but it isn't formatted again
+        self.assertTrue(credit.sources[0].sources[0] is credit)
+        self.assertEqual(format_credit(credit),
+                         ['<http://b/> title "http://b/" <http://b/> <> <>',
+                          'title "http://a/" <http://a/> <> <>'])
+
+    def test_source_cycle_lazy_same_as_eager(self):
+        # a -> b -> c -> b and a -> c: the cycle is cut where it closes
+        # on each path, whichever path reaches a subject first
+        g = rdflib.Graph()
+        a, b, c = [rdflib.URIRef('http://%s/' % n) for n in 'abc']
+        g.add((a, libcredit.DC['source'], b))
+        g.add((a, libcredit.DC['source'], c))
+        g.add((b, libcredit.DC['source'], c))
+        g.add((c, libcredit.DC['source'], b))
+
+        outputs = []
+        for lazy in (False, True):
+            credit = libcredit.Credit(g, a, lazy=lazy)
+            for c in (credit, credit.freeze()):
+                tf = libcredit.TextCreditFormatter()
+                c.format(tf, -1, None)
+                outputs.append(tf.get_text())
+        self.assertEqual(outputs, [outputs[0]] * 4)
+        self.assertEqual(outputs[0].count('http://b/'), 2)
+        self.assertEqual(outputs[0].count('http://c/'), 2)
+
+    def test_shared_sources(self):
+        g = rdflib.Graph()
+        a, b, c, d = [rdflib.URIRef('http://%s/' % n) for n in 'abcd']
+        g.add((a, libcredit.DC['source'], b))
+        g.add((a, libcredit.DC['source'], c))
+        g.add((b, libcredit.DC['source'], d))
+        g.add((c, libcredit.DCTERMS['source'], d))
+        credit = libcredit.Credit(g, a)
+        b_credit, c_credit = sorted(credit.sources, key=lambda s: s.get_subject_uri())
+        self.assertTrue(b_credit.sources[0] is c_credit.sources[0])
+
+    def test_deep_source_chain(self):
+        g = rdflib.Graph()
+        works = [rdflib.URIRef('http://work/%d' % i) for i in range(1500)]
+        for work, source in zip(works, works[1:]):
+            g.add((work, libcredit.DC['source'], source))
+        credit = libcredit.Credit(g, works[0])
+        depth = 0
+        while credit.sources:
+            credit = credit.sources[0]
+            depth += 1
+        self.assertEqual(depth, 1499)
+
+    def test_stats(self):
+        g = rdflib.Graph()
+        with open('../testcases/sources-with-sources.ttl') as f:
+            g.parse(f, format="n3")
+        stats = libcredit.CreditStats()
+        credit = libcredit.Credit(g, 'http://src/', stats=stats)
+        self.assertEqual(stats.sources, 4)
+        self.assertEqual(stats.subjects_extracted, 5)
+        # one index per subject, the literal title is not checked for being a container
+        self.assertEqual(stats.graph_queries, 5)
+        self.assertEqual(stats.container_queries, 0)
+        self.assertTrue(stats.times['extract'] >= 0)
+        self.assertTrue(stats.times['sources'] >= 0)
+
+        tf = libcredit.TextCreditFormatter()
+        credit.format(tf, 10, None, stats=stats)
+        self.assertEqual(stats.credits_formatted, 5)
+        self.assertEqual(stats.max_depth, 2)
+        self.assertEqual(stats.bytes_emitted, len(tf.get_text().encode('utf-8')))
+        self.assertEqual(stats.as_dict()['sources'], 4)
+        self.assertTrue('format_seconds' in stats.as_dict())
+
+        for formatter_class in (libcredit.HTMLCreditFormatter, libcredit.StreamingHTMLCreditFormatter):
+            stats = libcredit.CreditStats()
+            formatter = formatter_class()
+            credit.format(formatter, 10, None, stats=stats)
+            self.assertEqual(stats.bytes_emitted, len(formatter.get_text().encode('utf-8')))
+
+        # Each formatter in a MultiCreditFormatter is measured, formatters
+        # without output are not
+        stats = libcredit.CreditStats()
+        formatters = [libcredit.TextCreditFormatter(), libcredit.HTMLCreditFormatter(),
+                      TestCreditFormatter()]
+        credit.format(libcredit.MultiCreditFormatter(formatters), 10, None, stats=stats)
+        self.assertEqual(stats.bytes_emitted, sum(len(f.get_text().encode('utf-8'))
+                                                  for f in formatters[:2]))
+
+        stats = libcredit.CreditStats()
+        libcredit.Credit(load_rdfxml('rdf-containers'), 'http://src/', stats=stats)
+        self.assertTrue(stats.container_queries > 0)
+
+    def test_lazy(self):
+        for filename_prefix, uri in [('sources-with-sources', 'http://src/'),
+                                     ('source-with-full-attrib', 'http://src/'),
+                                     ('rdf-containers', 'http://src/')]:
+            credit = libcredit.Credit(load_credit(filename_prefix, uri).g, uri, lazy=True)
+            self.assertEqual(format_credit(credit), load_output(filename_prefix))
+
+    def test_lazy_source_depth(self):
+        g = load_credit('sources-with-sources', 'http://src/').g
+        credit = libcredit.Credit(g, 'http://src/', lazy=True)
+        self.assertTrue(credit._title is None)
+        credit.format(libcredit.TextCreditFormatter(), source_depth=1)
+        self.assertEqual(len(credit.sources), 2)
+        for source in credit.sources:
+            self.assertTrue(source._title is not None)
+            self.assertTrue(source._sources is None)
+
+    def test_lazy_source_cycle(self):
+        g = rdflib.Graph()
+        a = rdflib.URIRef('http://a/')
+        b = rdflib.URIRef('http://b/')
+        g.add((a, libcredit.DC['source'], b))
+        g.add((b, libcredit.DC['source'], a))
+        credit = libcredit.Credit(g, a, lazy=True)
+        self.assertTrue(credit.sources[0].sources[0] is credit)
+        self.assertEqual(format_credit(credit), format_credit(libcredit.Credit(g, a)))
+
+    def test_lazy_shared_sources(self):
+        # Each level of diamonds doubles the paths to the bottom work
+        g = rdflib.Graph()
+        top = rdflib.URIRef('http://work/0')
+        work = top
+        for i in range(1, 40):
+            left, right, bottom = [rdflib.URIRef('http://work/%d%s' % (i, n)) for n in ('l', 'r', '')]
+            for s, o in ((work, left), (work, right), (left, bottom), (right, bottom)):
+                g.add((s, libcredit.DC['source'], o))
+            work = bottom
+
+        credit = libcredit.Credit(g, top, lazy=True)
+        left, right = credit.sources
+        self.assertTrue(left.sources[0] is right.sources[0])
+        frozen = credit.freeze()
+        self.assertEqual(len(libcredit._get_credit_nodes(frozen)), 1 + 3 * 39)
+
+    def test_single_pass_lookup(self):
+        g = CountingGraph()
+        with open('../testcases/cc-full-attrib.ttl') as f:
+            g.parse(f, format="n3")
+        credit = libcredit.Credit(g, 'http://src/')
+        self.assertEqual(g.lookups, 1)
+        self.assertEqual(format_credit(credit), load_output('cc-full-attrib'))
+
+    def test_extract_many(self):
+        g = CountingGraph()
+        with open('../testcases/sources-with-sources.ttl') as f:
+            g.parse(f, format="n3")
+        credits = dict((c.get_subject_uri(), c) for c in libcredit.Credit.extract_many(g))
+        self.assertTrue('http://subsrc-1/' in credits)
+        self.assertTrue('http://subsrc-2/' in credits)
+        self.assertEqual(format_credit(credits['http://src/']), load_output('sources-with-sources'))
+        lookups = g.lookups
+
+        credits = list(libcredit.Credit.extract_many(g, ['http://src/', 'http://subsrc-1/']))
+        self.assertEqual([c.get_subject_uri() for c in credits], ['http://src/', 'http://subsrc-1/'])
+        self.assertEqual(g.lookups, lookups * 2)
+
+    def test_set_fields(self):
+        credit = libcredit.Credit(load_rdfxml('source-with-full-attrib'), 'http://src/', lazy=True)
+        credit.title = libcredit.CreditToken(u'new title')
+        credit.sources = []
+        self.assertEqual(credit.attrib.text, u'name of attribution')
+        tf = libcredit.TextCreditFormatter()
+        credit.format(tf)
+        self.assertEqual(tf.get_text(), u'new title by name of attribution (CC BY-SA 3.0 Unported).')
+
+    def test_compact_credits(self):
+        credit = load_credit('sources-with-sources', 'http://src/')
+        other = load_credit('sources-with-sources', 'http://src/')
+        for obj in (credit, credit.sources[0], credit.title, credit.attrib):
+            self.assertFalse(hasattr(obj, '__dict__'))
+            self.assertTrue(weakref.ref(obj)() is obj)
+        self.assertEqual(credit.title.text_property, u'http://purl.org/dc/elements/1.1/title')
+        self.assertTrue(credit.title.text_property is other.title.text_property)
+
+    def test_freeze(self):
+        for lazy in (False, True):
+            credit = load_credit('sources-with-sources', 'http://src/')
+            if lazy:
+                credit = libcredit.Credit(credit.g, 'http://src/', lazy=True)
+            frozen = credit.freeze()
+            self.assertTrue(frozen.g is None)
+            self.assertEqual(format_credit(frozen), load_output('sources-with-sources'))
+
+            data = pickle.dumps(credit, 2)
+            self.assertFalse(b'rdflib' in data)
+            self.assertEqual(format_credit(pickle.loads(data)), load_output('sources-with-sources'))
+
+        g = rdflib.Graph()
+        a, b, c, d = [rdflib.URIRef('http://%s/' % n) for n in 'abcd']
+        g.add((a, libcredit.DC['source'], b))
+        g.add((a, libcredit.DC['source'], c))
+        g.add((b, libcredit.DC['source'], d))
+        g.add((c, libcredit.DC['source'], d))
+        credit = libcredit.Credit(g, a).freeze()
+        self.assertTrue(credit.sources[0].sources[0] is credit.sources[1].sources[0])
+        credit = pickle.loads(pickle.dumps(libcredit.Credit(g, a), 2))
+        self.assertTrue(credit.sources[0].sources[0] is credit.sources[1].sources[0])
+
+    def test_pickle_deep_source_chain(self):
+        g = rdflib.Graph()
+        works = [rdflib.URIRef('http://work/%d/' % i) for i in range(3000)]
+        for work, source in zip(works, works[1:]):
+            g.add((work, libcredit.DC['source'], source))
+        credit = pickle.loads(pickle.dumps(libcredit.Credit(g, works[0]), 2))
+        depth = 0
+        while credit.sources:
+            credit = credit.sources[0]
+            depth += 1
+        self.assertEqual(depth, 2999)
+
+    def test_serialize_credit(self):
+        credit = load_credit('sources-with-sources', 'http://src/')
+        data = libcredit.serialize_credit(credit)
+        copy = libcredit.deserialize_credit(data)
+        self.assertEqual(format_credit(copy), load_output('sources-with-sources'))
+        self.assertEqual(libcredit.serialize_credit(copy), data)
+
+        credit = load_credit('multiple-creators', 'http://src/')
+        copy = libcredit.deserialize_credit(libcredit.serialize_credit(credit))
+        self.assertEqual(format_credit(copy), format_credit(credit))
+
+        self.assertRaises(ValueError, libcredit.deserialize_credit, '{"version":0,"nodes":[]}')
+        self.assertRaises(ValueError, libcredit.deserialize_credit, '{"version":1,"nodes":[]}')
+
+    def test_credit_cache(self):
+        rdf = load_rdfxml('sources-with-sources')
+        directory = tempfile.mkdtemp()
+        try:
+            cache = libcredit.CreditCache(directory)
+            parse_count = libcredit.Credit.parse_count
+            credit = libcredit.Credit(rdf, 'http://src/', cache=cache)
+            self.assertTrue(credit.g is not None)
+            credit = libcredit.Credit(rdf, 'http://src/', cache=cache)
+            self.assertTrue(credit.g is None)
+            self.assertEqual(format_credit(credit), load_output('sources-with-sources'))
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+            cache = libcredit.CreditCache(directory)
+            credit = libcredit.Credit(rdf, 'http://src/', cache=cache)
+            self.assertEqual(format_credit(credit), load_output('sources-with-sources'))
+            self.assertEqual(cache.hits, 1)
+            self.assertEqual(libcredit.Credit.parse_count, parse_count + 1)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_fast_parse(self):
+        for filename_prefix, uri in [('source-with-full-attrib', 'http://src/'),
+                                     ('sources-with-sources', 'http://src/'),
+                                     ('rdf-containers', 'http://src/'),
+                                     ('flickr-photos-by', 'http://www.flickr.com/photos/somecreator/123/')]:
+            credit = libcredit.Credit(load_rdfxml(filename_prefix), uri, fast=True)
+            self.assertTrue(credit.g is None)
+            self.assertEqual(format_credit(credit), load_output(filename_prefix))
+
+    def test_fast_parse_xmp(self):
+        xmp = u"""<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+          xmlns:dc="http://purl.org/dc/elements/1.1/"
+          xmlns:cc="http://creativecommons.org/ns#">
+  <rdf:Description rdf:about="">
+   <dc:source rdf:resource="http://src/"/>
+  </rdf:Description>
+  <rdf:Description rdf:about="http://src/" cc:license="http://creativecommons.org/licenses/by/3.0/">
+   <dc:title><rdf:Alt><rdf:li xml:lang="x-default">main title</rdf:li></rdf:Alt></dc:title>
+   <dc:creator><rdf:Seq><rdf:li>creator1</rdf:li><rdf:li>creator2</rdf:li></rdf:Seq></dc:creator>
+  </rdf:Description>
+ </rdf:RDF>
+</x:xmpmeta>
+<?xpacket end="w"?>"""
+        credit = libcredit.Credit(xmp, fast=True)
+        tf = libcredit.TextCreditFormatter()
+        credit.format(tf)
+        self.assertEqual(tf.get_text(), u'main title by creator1, creator2 (CC BY 3.0 Unported).')
+
+    def test_fast_parse_fallback(self):
+        rdf = """<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+                          xmlns:dc="http://purl.org/dc/elements/1.1/">
+  <rdf:Description rdf:about="http://src/">
+   <dc:title>a title</dc:title>
+   <dc:description rdf:parseType="Literal"><b>markup</b></dc:description>
+  </rdf:Description>
+</rdf:RDF>"""
+        credit = libcredit.Credit(rdf, 'http://src/', fast=True)
+        self.assertTrue(credit.g is not None)
+        self.assertEqual(credit.title.text, u'a title')
+
+    def test_render_credits(self):
+        documents = [
+            (load_rdfxml('source-with-full-attrib'), 'http://src/'),
+            'not RDF',
+            (load_rdfxml('dc-title-text'), 'urn:src'),
+        ]
+        for processes in (1, 2):
+            results = list(libcredit.render_credits(documents, processes=processes))
+            self.assertEqual(len(results), 3)
+            self.assertEqual(results[0].text,
+                u'a title by name of attribution (CC BY-SA 3.0 Unported). Source:\n' + \
+                '    * subsrc title by subsrc attribution (CC BY-NC-ND 3.0 Unported).')
+            self.assertTrue(results[0].error is None)
+            self.assertTrue(results[1].text is None)
+            self.assertTrue(results[1].error)
+            self.assertEqual(results[2].text, u'a title.')
+
+        self.assertRaises(IOError, libcredit.render_credits, documents, languages=['xx'])
+
+    def test_main_unreadable_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            good = os.path.join(directory, 'good.rdf')
+            with open(good, 'w') as f:
+                f.write(TITLE_RDFXML)
+            missing = os.path.join(directory, 'missing.rdf')
+
+            status, out, err = run_main(['-j', '1', missing, good])
+            self.assertEqual(status, 1)
+            self.assertEqual(out, u'a title.\n')
+            self.assertTrue(missing in err)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_render_cache(self):
+        rdf = load_rdfxml('source-with-full-attrib')
+        cache = libcredit.RenderCache()
+        parse_count = libcredit.Credit.parse_count
+
+        text = cache.render(rdf, 'http://src/')
+        self.assertEqual(cache.render(rdf, 'http://src/'), text)
+        self.assertEqual(libcredit.Credit.parse_count, parse_count + 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        html = cache.render(rdf, 'http://src/', html=True, classes={'root': 'credit'})
+        self.assertNotEqual(html, text)
+        self.assertNotEqual(cache.render(rdf, 'http://src/', html=True), html)
+        self.assertNotEqual(cache.render(rdf, 'http://src/', source_depth=0), text)
+        self.assertEqual(cache.misses, 4)
+
+    def test_render_cache_limits(self):
+        rdf = load_rdfxml('source-with-full-attrib')
+        cache = libcredit.RenderCache(maxsize=2)
+        for depth in (0, 1, 2):
+            cache.render(rdf, 'http://src/', source_depth=depth)
+        self.assertEqual((len(cache), cache.evictions), (2, 1))
+
+        text = cache.render(rdf, 'http://src/')
+        cache = libcredit.RenderCache(maxbytes=len(text.encode('utf-8')) + 10)
+        cache.render(rdf, 'http://src/')
+        cache.render(rdf, 'http://src/', source_depth=0)
+        self.assertEqual((len(cache), cache.evictions), (1, 1))
+        self.assertTrue(cache.size <= len(text.encode('utf-8')) + 10)
+
+        cache = libcredit.RenderCache(ttl=0)
+        cache.render(rdf, 'http://src/')
+        cache.render(rdf, 'http://src/')
+        self.assertEqual((cache.hits, cache.misses, cache.expirations), (0, 2, 1))
+
+    def test_stream_credits(self):
+        with open('../testcases/dc-title-text.ttl') as f:
+            turtle = f.read()
+        records = [
+            {'id': 1, 'rdf': load_rdfxml('dc-title-text'), 'subject': 'urn:src'},
+            {'id': 2, 'rdf': 'not RDF'},
+            {'id': 3, 'rdf': turtle, 'format': 'turtle', 'subject': 'urn:src'},
+        ]
+        results = list(libcredit.stream_credits(records))
+        self.assertEqual(results[0], {'id': 1, 'text': u'a title.'})
+        self.assertEqual(sorted(results[1].keys()), ['error', 'id'])
+        self.assertEqual(results[2], {'id': 3, 'text': u'a title.'})
+
+        results = list(libcredit.stream_credits(records[:1], output='tokens'))
+        self.assertEqual(results[0]['tokens'], [
+            ('begin', 0, None, u'urn:src', None, None),
+            ('title', 0, u'a title', None, u'http://purl.org/dc/elements/1.1/title', None),
+            ('text', 0, u'.', None, None, None),
+            ('end', 0, None, None, None, None),
+        ])
+
+    def test_stream_credits_files(self):
+        directory = tempfile.mkdtemp()
+        try:
+            works = os.path.join(directory, 'works')
+            os.mkdir(works)
+            shutil.copy('../testcases/dc-title-text.ttl', works)
+            with open(os.path.join(works, 'title.rdf'), 'w') as f:
+                f.write(TITLE_RDFXML)
+            archive = os.path.join(directory, 'works.tar')
+            tar = tarfile.open(archive, 'w')
+            tar.add(works, 'works')
+            tar.close()
+
+            for path in (works, archive):
+                results = list(libcredit.stream_credits(libcredit._read_records([path])))
+                self.assertEqual(sorted(os.path.basename(r['id']) for r in results),
+                                 ['dc-title-text.ttl', 'title.rdf'])
+                self.assertEqual([r.get('text') for r in results], [u'a title.'] * 2)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_no_default_subject(self):
+        g = rdflib.Graph()
+        g.add((rdflib.URIRef('urn:src'), libcredit.DC['title'], rdflib.Literal('a title')))
+        self.assertRaises(ValueError, libcredit.Credit, g)
+
+    def test_main_tokens_without_ndjson(self):
+        status, out, err = run_main(['--tokens', '../testcases/dc-title-text.ttl'])
+        self.assertEqual(status, 2)
+        self.assertTrue('--ndjson' in err)
+
+    def test_streaming_html_formatter(self):
+        def elements(html):
+            # the attribute order differs on Python 3.8 and later
+            node = minidom.parseString(html.encode('utf-8')).documentElement
+            return [(e.tagName, sorted(e.attributes.items()), [c.data for c in e.childNodes
+                                                              if c.nodeType == c.TEXT_NODE])
+                    for e in [node] + node.getElementsByTagName('*')]
+
+        credit = load_credit('sources-with-sources', 'http://src/')
+        classes = {'root': 'credit', 'license': 'redprint'}
+        for subject_uri in (None, 'http://src/'):
+            expected = libcredit.HTMLCreditFormatter(classes=classes)
+            credit.format(expected, 10, subject_uri=subject_uri)
+            formatter = libcredit.StreamingHTMLCreditFormatter(classes=classes)
+            credit.format(formatter, 10, subject_uri=subject_uri)
+            self.assertEqual(elements(formatter.get_text()), elements(expected.get_text()))
+
+    def test_token_formatter(self):
+        credit = load_credit('source-with-full-attrib', 'http://src/')
+        tf = libcredit.TokenCreditFormatter()
+        credit.format(tf, 10, subject_uri='http://src/')
+        events = tf.get_events()
+        self.assertEqual(events[:2], [
+            ('begin', 0, None, 'http://src/', None, None),
+            ('title', 0, u'a title', u'http://src/', u'http://purl.org/dc/elements/1.1/title', None),
+        ])
+        self.assertEqual([e[:2] for e in events if e[0].endswith('source') or e[0] == 'end'],
+                         [('begin_source', 1), ('end', 1), ('end_source', 1), ('end', 0)])
+
+        for formatter_class in (libcredit.TextCreditFormatter, libcredit.HTMLCreditFormatter):
+            expected = formatter_class()
+            credit.format(expected, 10, subject_uri='http://src/')
+            formatter = formatter_class()
+            libcredit.TokenCreditFormatter.replay(json.loads(tf.get_json()), formatter)
+            self.assertEqual(formatter.get_text(), expected.get_text())
+
+        self.assertRaises(ValueError, libcredit.TokenCreditFormatter.replay,
+                          [['get_text', 0, None, None, None, None]], libcredit.TextCreditFormatter())
+
+    def test_multi_formatter(self):
+        credit = load_credit('source-with-full-attrib', 'http://src/')
+        formatter_classes = (libcredit.TextCreditFormatter, libcredit.HTMLCreditFormatter,
+                             libcredit.TokenCreditFormatter, TestCreditFormatter)
+        formatters = [cls() for cls in formatter_classes]
+        credit.format(libcredit.MultiCreditFormatter(formatters), 10, subject_uri='http://src/')
+
+        for cls, formatter in zip(formatter_classes, formatters):
+            expected = cls()
+            credit.format(expected, 10, subject_uri='http://src/')
+            if cls is TestCreditFormatter:
+                self.assertEqual(formatter.output, expected.output)
+            elif cls is libcredit.TokenCreditFormatter:
+                self.assertEqual(formatter.get_events(), expected.get_events())
+            else:
+                self.assertEqual(formatter.get_text(), expected.get_text())
+
     def test_text_formatter(self):
         credit = load_credit('source-with-full-attrib', 'http://src/')
         tf = libcredit.TextCreditFormatter()
@@ -161,6 +746,28 @@ class LibCreditTests(unittest.TestCase):
             u'a title by name of attribution (CC BY-SA 3.0 Unported). Source:\n' + \
             '    * subsrc title by subsrc attribution (CC BY-NC-ND 3.0 Unported).')
 
+    def test_text_formatter_stream(self):
+        credit = load_credit('source-with-full-attrib', 'http://src/')
+        stream = io.StringIO()
+        tf = libcredit.TextCreditFormatter(stream)
+        credit.format(tf)
+        self.assertEqual(stream.getvalue(),
+            u'a title by name of attribution (CC BY-SA 3.0 Unported). Source:\n' + \
+            '    * subsrc title by subsrc attribution (CC BY-NC-ND 3.0 Unported).')
+        self.assertEqual(tf.get_text(), u'')
+
+    def test_text_formatter_many_sources(self):
+        g = rdflib.Graph()
+        work = rdflib.URIRef('http://work/')
+        for i in range(500):
+            g.add((work, libcredit.DC['source'], rdflib.URIRef('http://src/%03d' % i)))
+        credit = libcredit.Credit(g, work)
+        tf = libcredit.TextCreditFormatter()
+        credit.format(tf)
+        lines = tf.get_text().split('\n')
+        self.assertEqual(lines[0], u'http://work/. Sources:')
+        self.assertEqual(sorted(lines[1:]), [u'    * http://src/%03d.' % i for i in range(500)])
+
     def test_i18n(self):
         i18n = gettext.translation('libcredit', '../build/mo', languages = ['sv'])
         i18n.set_output_charset('utf-8')
@@ -183,6 +790,51 @@ class LibCreditTests(unittest.TestCase):
             u'    * http://subsrc-1/.'
         self.assertTrue(tf.get_text() == expected1 or tf.get_text() == expected2)
 
+    def test_translation_registry(self):
+        registry = libcredit.TranslationRegistry('../build/mo')
+        registry.preload(['sv', 'ru'])
+        self.assertTrue(registry.get('sv') is registry.get(['sv']))
+        self.assertTrue(registry.get(['xx', 'sv']) is not registry.get('sv'))
+        self.assertRaises(IOError, registry.get, 'xx')
+
+        credit = load_credit('source-with-full-attrib', 'http://src/')
+        tf = libcredit.TextCreditFormatter()
+        credit.format(tf, 0, registry.get('sv'))
+        self.assertEqual(tf.get_text(), u'a title av name of attribution (CC BY-SA 3.0 Unported).')
+
+        localedir = libcredit.translation_registry.localedir
+        libcredit.translation_registry.localedir = '../build/mo'
+        try:
+            tf = libcredit.TextCreditFormatter()
+            credit.format(tf, 0, 'sv')
+            self.assertEqual(tf.get_text(), u'a title av name of attribution (CC BY-SA 3.0 Unported).')
+        finally:
+            libcredit.translation_registry.localedir = localedir
+            libcredit.translation_registry.clear()
+
+    def test_compiled_templates(self):
+        class CountingTranslations(gettext.NullTranslations):
+            calls = 0
+            def gettext(self, message):
+                CountingTranslations.calls += 1
+                return message
+            def ngettext(self, msgid1, msgid2, n):
+                CountingTranslations.calls += 1
+                return msgid1 if n == 1 else msgid2
+            ugettext = gettext
+            ungettext = ngettext
+
+        i18n = CountingTranslations()
+        credit = load_credit('source-with-full-attrib', 'http://src/')
+        for i in range(3):
+            tf = libcredit.TextCreditFormatter()
+            credit.format(tf, 10, i18n)
+            self.assertEqual(tf.get_text(),
+                u'a title by name of attribution (CC BY-SA 3.0 Unported). Source:\n' + \
+                '    * subsrc title by subsrc attribution (CC BY-NC-ND 3.0 Unported).')
+        # one template and one source label
+        self.assertEqual(CountingTranslations.calls, 2)
+
     def test_rdf_containers(self):
         credit = load_credit('rdf-containers', 'http://src/')
         tf = libcredit.TextCreditFormatter()
@@ -190,6 +842,48 @@ class LibCreditTests(unittest.TestCase):
         self.assertEqual(tf.get_text(),
             u'main title by creator1, creator2.')
 
+    def test_rdf_collections(self):
+        g = rdflib.Graph()
+        g.parse(data='@prefix dc: <http://purl.org/dc/elements/1.1/> .\n'
+                     '<http://src/> dc:title "main title" ; dc:creator ( "creator1" "creator2" "creator3" ) .',
+                format='n3')
+        credit = libcredit.Credit(g, 'http://src/')
+        self.assertEqual(credit.attrib.text, [u'creator1', u'creator2', u'creator3'])
+
+        credit = libcredit.Credit(g.serialize(format='xml'), 'http://src/', fast=True)
+        self.assertTrue(credit.g is None)
+        self.assertEqual(credit.attrib.text, [u'creator1', u'creator2', u'creator3'])
+
+    def test_rdf_alt_creator(self):
+        rdf = """<?xml version="1.0"?>
+<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+         xmlns:dc="http://purl.org/dc/elements/1.1/">
+  <rdf:Description rdf:about="http://src/">
+    <dc:title>a title</dc:title>
+    <dc:creator><rdf:Alt><rdf:li>Jane</rdf:li><rdf:li>J.</rdf:li></rdf:Alt></dc:creator>
+  </rdf:Description>
+  <rdf:Description rdf:about="http://empty/">
+    <dc:title>a title</dc:title>
+    <dc:creator><rdf:Alt/></dc:creator>
+  </rdf:Description>
+</rdf:RDF>"""
+        for fast in (False, True):
+            self.assertEqual(libcredit.Credit(rdf, 'http://src/', fast=fast).attrib.text, u'Jane')
+            self.assertTrue(libcredit.Credit(rdf, 'http://empty/', fast=fast).attrib.text is None)
+
+    def test_large_container(self):
+        g = rdflib.Graph()
+        src = rdflib.URIRef('http://src/')
+        seq = rdflib.BNode()
+        g.add((src, libcredit.DC['creator'], seq))
+        g.add((seq, rdflib.RDF.type, rdflib.RDF.Seq))
+        for i in range(1, 501):
+            g.add((seq, rdflib.URIRef('%s_%d' % (rdflib.RDF, i)), rdflib.Literal('creator%d' % i)))
+        stats = libcredit.CreditStats()
+        credit = libcredit.Credit(g, src, stats=stats)
+        self.assertEqual(credit.attrib.text, [u'creator%d' % i for i in range(1, 501)])
+        self.assertTrue(stats.graph_queries < 10)
+
     def test_multiple_creators(self):
         credit = load_credit('multiple-creators', 'http://src/')
         tf = libcredit.TextCreditFormatter()
@@ -222,3 +916,39 @@ class LibCreditTests(unittest.TestCase):
             classes={'root': 'credit', 'license': 'redprint'})
         credit.format(cf, subject_uri="#xyz")
         self.assertEqual(cf.root.toxml(), expected)
+
+    def test_streaming_html(self):
+        credit = load_credit('dc-title-text', 'urn:src')
+        cf = libcredit.StreamingHTMLCreditFormatter()
+        credit.format(cf)
+        self.assertEqual(cf.get_text(), '<div><p><span>a title</span>.</p></div>')
+
+        credit = load_credit('source-with-full-attrib', 'http://src/')
+        with open('../testcases/source-with-full-attrib.out.html') as f:
+            expected = ensure_unicode(f.read())
+        cf = libcredit.StreamingHTMLCreditFormatter()
+        credit.format(cf, subject_uri="#xyz")
+        self.assertEqual(cf.get_text(), expected)
+
+        with open('../testcases/source-with-full-attrib-custom.out.html') as f:
+            expected = ensure_unicode(f.read())
+        stream = io.StringIO()
+        cf = libcredit.StreamingHTMLCreditFormatter(stream,
+            element_overrides={'source_list': 'ol'},
+            classes={'root': 'credit', 'license': 'redprint'})
+        credit.format(cf, subject_uri="#xyz")
+        self.assertEqual(stream.getvalue(), expected)
+
+    def test_streaming_html_escaping(self):
+        credit = load_credit('nothing', 'urn:src')
+        credit.title.text = u'<"Fish" & Chips>'
+        credit.title.url = u'http://src/?a=1&b="2"'
+        cf = libcredit.StreamingHTMLCreditFormatter()
+        credit.format(cf)
+        self.assertEqual(cf.get_text(),
+            u'<div><p><a href="http://src/?a=1&amp;b=&quot;2&quot;">&lt;&quot;Fish&quot; &amp; Chips&gt;</a>.</p></div>')
+
+        credit = load_credit('nothing', 'urn:src')
+        cf = libcredit.StreamingHTMLCreditFormatter()
+        credit.format(cf)
+        self.assertEqual(cf.get_text(), u'<div><p/></div>')
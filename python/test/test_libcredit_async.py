@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# libcredit - module for converting RDF metadata to human-readable strings
+#
+# Copyright 2013 Commons Machinery http://commonsmachinery.se/
+#
+# Distributed under an GPLv2 license, please see LICENSE in the top dir.
+
+import sys
+import threading
+import unittest
+
+import libcredit
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    import libcredit_async
+else:
+    libcredit_async = None
+
+from .helpers import load_rdfxml
+
+
+def format_text(rdf, subject, source_depth=1):
+    tf = libcredit.TextCreditFormatter()
+    libcredit.Credit(rdf, subject).format(tf, source_depth)
+    return tf.get_text()
+
+
+@unittest.skipIf(libcredit_async is None, 'asyncio requires Python 3.5')
+class AsyncCreditRendererTests(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def run_loop(self, *coroutines):
+        return self.loop.run_until_complete(asyncio.gather(*coroutines))
+
+    def test_render(self):
+        rdf = load_rdfxml('source-with-full-attrib')
+        renderer = libcredit_async.AsyncCreditRenderer()
+        text, html = self.run_loop(renderer.render(rdf, 'http://src/'),
+                                   renderer.render(rdf, 'http://src/', html=True))
+        self.assertEqual(text, format_text(rdf, 'http://src/'))
+        self.assertTrue(html.startswith(u'<div'))
+
+    def test_coalesce(self):
+        rdf = load_rdfxml('source-with-full-attrib')
+        renderer = libcredit_async.AsyncCreditRenderer()
+        results = self.run_loop(*[renderer.render(rdf, 'http://src/') for i in range(10)])
+        self.assertEqual(results, [format_text(rdf, 'http://src/')] * 10)
+        self.assertEqual((renderer.renders, renderer.coalesced), (1, 9))
+
+        # Once done, the same document is rendered again
+        self.run_loop(renderer.render(rdf, 'http://src/'),
+                      renderer.render(rdf, 'http://src/', source_depth=0))
+        self.assertEqual(renderer.renders, 3)
+
+    def test_max_concurrency(self):
+        rdf = load_rdfxml('source-with-full-attrib')
+        renderer = libcredit_async.AsyncCreditRenderer(max_concurrency=2)
+        running = [0, 0]
+        lock = threading.Lock()
+        render_credit = libcredit._render_credit
+
+        def counting_render(*args):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            try:
+                return render_credit(*args)
+            finally:
+                with lock:
+                    running[0] -= 1
+
+        libcredit._render_credit = counting_render
+        try:
+            self.run_loop(*[renderer.render(rdf, 'http://src/', source_depth=i) for i in range(8)])
+        finally:
+            libcredit._render_credit = render_credit
+        self.assertEqual(renderer.renders, 8)
+        self.assertTrue(running[1] <= 2)
+
+    def test_render_many(self):
+        rdf = load_rdfxml('source-with-full-attrib')
+        renderer = libcredit_async.AsyncCreditRenderer(max_concurrency=4)
+        results = self.loop.run_until_complete(renderer.render_many(
+            [(rdf, 'http://src/'), 'not rdf', (rdf, 'http://src/')]))
+        self.assertEqual([r.text for r in results],
+                         [format_text(rdf, 'http://src/'), None, format_text(rdf, 'http://src/')])
+        self.assertTrue(results[1].error)
+        self.assertEqual(renderer.renders, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# libcredit - module for converting RDF metadata to human-readable strings
+#
+# Copyright 2013 Commons Machinery http://commonsmachinery.se/
+#
+# Distributed under an GPLv2 license, please see LICENSE in the top dir.
+
+import json
+import socket
+import unittest
+
+from libcredit import ensure_unicode
+import libcredit_server
+
+from .helpers import load_rdfxml
+
+try:
+    from http.client import HTTPConnection
+except ImportError:
+    from httplib import HTTPConnection
+
+
+class CreditServerTests(unittest.TestCase):
+    def test_credit_server(self):
+        rdf = load_rdfxml('source-with-full-attrib')
+        text = u'a title by name of attribution (CC BY-SA 3.0 Unported). Source:\n' + \
+               '    * subsrc title by subsrc attribution (CC BY-NC-ND 3.0 Unported).'
+
+        for processes in (1, 2):
+            with libcredit_server.CreditServer(processes=processes) as server:
+                server.start()
+                conn = HTTPConnection(*server.server_address)
+
+                def request(method, path, body=None, headers={}):
+                    conn.request(method, path, body, headers)
+                    response = conn.getresponse()
+                    return response.status, response.read().decode('utf-8')
+
+                self.assertEqual(request('POST', '/render?subject=http://src/', rdf),
+                                 (200, text))
+                status, html = request('POST', '/render?subject=http://src/&output=html', rdf)
+                self.assertTrue(html.startswith(u'<div'))
+                self.assertEqual(request('POST', '/render?depth=0', 'not RDF')[0], 422)
+
+                records = [{'id': 1, 'rdf': ensure_unicode(rdf), 'subject': 'http://src/'},
+                           {'id': 2, 'rdf': 'not RDF'}]
+                status, body = request('POST', '/render', json.dumps(records),
+                                       {'Content-Type': 'application/json'})
+                results = json.loads(body)
+                self.assertEqual(results[0], {'id': 1, 'text': text})
+                self.assertTrue(results[1]['error'])
+                self.assertEqual(request('POST', '/render', '{', {'Content-Type': 'application/json'})[0], 400)
+                self.assertEqual(request('GET', '/nothing')[0], 404)
+
+                stats = json.loads(request('GET', '/stats')[1])
+                self.assertEqual(stats['connections'], 1)
+                self.assertEqual((stats['requests'], stats['documents'], stats['errors']), (5, 5, 2))
+                self.assertEqual(stats['latency']['count'], 5)
+                self.assertEqual(sum(b['count'] for b in stats['latency']['buckets']), 5)
+                conn.close()
+
+    def test_latency_histogram(self):
+        histogram = libcredit_server.LatencyHistogram(bounds=(0.01, 0.1))
+        self.assertTrue(histogram.percentile(50) is None)
+        for seconds in (0.005, 0.01, 0.05, 0.5):
+            histogram.add(seconds)
+        self.assertEqual(histogram.counts, [2, 1, 1])
+        self.assertEqual(histogram.percentile(50), 0.01)
+        self.assertEqual(histogram.percentile(75), 0.1)
+        self.assertEqual(histogram.percentile(100), 0.5)
+
+    def test_negative_content_length(self):
+        with libcredit_server.CreditServer(processes=1) as server:
+            server.start()
+            conn = socket.create_connection(server.server_address, timeout=5)
+            try:
+                conn.sendall(b'POST /render HTTP/1.1\r\nHost: localhost\r\n'
+                             b'Content-Length: -1\r\n\r\n')
+                self.assertTrue(conn.recv(1024).startswith(b'HTTP/1.1 400'))
+            finally:
+                conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,7 +13,7 @@ setup(
     description = 'Generate attribution and license messages from RDF metadata',
     license = 'GPLv2',
 
-    py_modules=['libcredit'],
+    py_modules=['libcredit', 'libcredit_async', 'libcredit_server'],
     package_dir = { '': 'python' },
     cmdclass={
         "build": build_extra.build_extra,